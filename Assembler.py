@@ -0,0 +1,141 @@
+from array import array
+
+# predefined symbols of the Hack assembly language
+SYMBOLS = {'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4, 'SCREEN': 16384, 'KBD': 24576}
+SYMBOLS.update({f'R{i}': i for i in range(16)})
+
+# comp field -> a bit and c1..c6, the first name for each code is the usual spelling
+COMP = {
+    '0':   0b0101010, '1':   0b0111111, '-1':  0b0111010,
+    'D':   0b0001100, 'A':   0b0110000, 'M':   0b1110000,
+    '!D':  0b0001101, '!A':  0b0110001, '!M':  0b1110001,
+    '-D':  0b0001111, '-A':  0b0110011, '-M':  0b1110011,
+    'D+1': 0b0011111, 'A+1': 0b0110111, 'M+1': 0b1110111,
+    'D-1': 0b0001110, 'A-1': 0b0110010, 'M-1': 0b1110010,
+    'D+A': 0b0000010, 'D+M': 0b1000010, 'D-A': 0b0010011, 'D-M': 0b1010011,
+    'A-D': 0b0000111, 'M-D': 0b1000111, 'D&A': 0b0000000, 'D&M': 0b1000000,
+    'D|A': 0b0010101, 'D|M': 0b1010101,
+    'A+D': 0b0000010, 'M+D': 0b1000010, 'A&D': 0b0000000, 'M&D': 0b1000000,
+    'A|D': 0b0010101, 'M|D': 0b1010101,
+}
+DEST = {'A': 0b100, 'D': 0b010, 'M': 0b001}
+JUMP = {'': 0, 'JGT': 1, 'JEQ': 2, 'JGE': 3, 'JLT': 4, 'JNE': 5, 'JLE': 6, 'JMP': 7}
+
+# for decoding: code -> usual spelling
+COMP_NAMES = {}
+for name, code in COMP.items():
+    COMP_NAMES.setdefault(code, name)
+JUMP_NAMES = {code: name for name, code in JUMP.items()}
+
+ROM_SIZE = 32768
+MAX_ADDRESS = 32767             # the largest value an A-instruction can load
+
+def encode(text: str) -> int:
+    """Returns the machine code for a C-instruction, or None if it is invalid."""
+    dest, eq, rest = text.rpartition('=')
+    comp, semi, jump = rest.partition(';')
+    if comp not in COMP or jump not in JUMP or (semi and not jump):
+        return None
+    destBits = 0
+    for register in dest:
+        if register not in DEST or DEST[register] & destBits:
+            return None
+        destBits |= DEST[register]
+    return 0b111 << 13 | COMP[comp] << 6 | destBits << 3 | JUMP[jump]
+
+def decode(word: int):
+    """
+    Returns an A-instruction's value, or (dest, comp, jump) for a
+    C-instruction, with dest in ADM order and '' for empty fields.
+    """
+    if not word & 0x8000:
+        return word
+    comp = COMP_NAMES.get(word >> 6 & 0b1111111)
+    if comp is None:
+        raise ValueError(f'Invalid instruction: {word:016b}')
+    dest = ''.join(register for register, bit in DEST.items() if word >> 3 & bit)
+    return dest, comp, JUMP_NAMES[word & 0b111]
+
+class Assembler:
+    """
+    Assembles Hack assembly code into machine code in a single pass, so
+    the translator can write a .hack file without a separate assembler
+    run. A label used before it is defined is filled in when the label
+    is found. Symbols that are never defined as labels, such as static
+    variables, are given RAM addresses from 16 up in the order they are
+    first used, as the standard two-pass assembler does. Code can be
+    given a chunk at a time with writelines(), like a file.
+    """
+
+    def __init__(self, outFilename: str = None) -> None:
+        self.outFilename = outFilename
+        self.words = array('H')     # machine code
+        self.symbols = dict(SYMBOLS)
+        self.pending = {}           # symbol not yet defined -> indices in words of the instructions using it
+        self.encoded = {}           # C-instruction text -> machine code, there are few different ones
+        self.lineNumber = 0
+
+    def writelines(self, lines: list) -> None:
+        """Assembles lines of code, which may contain comments, labels and blank lines."""
+        words = self.words
+        symbols = self.symbols
+        encoded = self.encoded
+        for line in lines:
+            self.lineNumber += 1
+            text = line.strip()
+            if '//' in text:
+                text = text.split('//', 1)[0].strip()
+            if not text:
+                continue
+            if text[0] == '@':
+                symbol = text[1:]
+                if symbol.isdigit():
+                    value = int(symbol)
+                    if value > MAX_ADDRESS:
+                        raise ValueError(f'Line {self.lineNumber}: constant out of range: {text}')
+                elif symbol in symbols:
+                    value = symbols[symbol]
+                else:
+                    self.pending.setdefault(symbol, []).append(len(words))
+                    value = 0
+                words.append(value)
+            elif text[0] == '(':
+                label = text[1:-1]
+                if not label or text[-1] != ')' or label in symbols:
+                    raise ValueError(f'Line {self.lineNumber}: invalid or duplicate label: {text}')
+                symbols[label] = len(words)
+                for i in self.pending.pop(label, []):
+                    words[i] = len(words)
+            else:
+                word = encoded.get(text)
+                if word is None:
+                    word = encoded[text] = encode(text)
+                    if word is None:
+                        raise ValueError(f'Line {self.lineNumber}: invalid instruction: {text}')
+                words.append(word)
+
+    def finish(self) -> array:
+        """
+        Allocates the variables and returns the machine code. Raises
+        ValueError if the program does not fit in ROM, or a label or
+        variable address is too big for an A-instruction.
+        """
+        if len(self.words) > ROM_SIZE:
+            raise ValueError(f'The program is {len(self.words)} words long, ROM holds {ROM_SIZE}')
+        address = 16
+        for symbol, uses in self.pending.items():
+            self.symbols[symbol] = address
+            for i in uses:
+                self.words[i] = address
+            address += 1
+        self.pending = {}
+        for symbol, value in self.symbols.items():
+            if value > MAX_ADDRESS:
+                raise ValueError(f'The address of {symbol}, {value}, is out of range')
+        return self.words
+
+    def close(self) -> None:
+        """Finishes the code and writes it to the output file, one word per line."""
+        words = self.finish()
+        with open(self.outFilename, 'w') as f:
+            f.writelines(f'{word:016b}\n' for word in words)
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# Batch translation: many projects in one run, across a pool of processes.
+
+import Assembler
+import Translator
+import vmt
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+def translateProject(source: str, options: dict, hack: bool = False) -> dict:
+    """
+    Translates one project, a .vm file or a directory of them, to the
+    same output file vmt.py would write. Runs in a worker process.
+    Returns a report of the project; a failure is reported, not raised,
+    and leaves any earlier output file as it was.
+    """
+    start = time.perf_counter()
+    result = {'source': source, 'output': None, 'status': 'ok', 'error': None,
+              'files': 0, 'vmLines': 0, 'words': 0, 'seconds': 0}
+    temp = None
+    try:
+        files, outFilename = projectFiles(source, '.hack' if hack else '.asm')
+        sources = []
+        for file in files:
+            with open(file) as f:
+                code = f.read()
+            sources.append((file, code))
+            result['vmLines'] += len(code.splitlines())
+        result['files'] = len(files)
+        translator = Translator.Translator(**options)
+        # written under another name first, so a failed translation leaves no partial output
+        temp = outFilename + '.tmp'
+        if hack:
+            assembler = Assembler.Assembler(temp)
+            assembler.writelines(translator.translate(sources))
+            assembler.close()
+        else:
+            with open(temp, 'w') as f:
+                f.writelines(translator.translate(sources))
+        os.replace(temp, outFilename)
+        temp = None
+        result.update(output=outFilename, words=translator.writer.words)
+    except Translator.TranslationError as e:
+        result.update(status='error', error={'type': type(e).__name__, 'message': e.message,
+                      'file': e.filename, 'line': e.line, 'text': e.text})
+    except Exception as e:
+        # e.g. an unreadable file, or a program too big for ROM when assembling
+        result.update(status='error', error={'type': type(e).__name__, 'message': str(e)})
+    finally:
+        if temp and os.path.exists(temp):
+            os.remove(temp)
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+def projectFiles(source: str, outExt: str) -> tuple:
+    """
+    Returns the .vm files of a project and its output file name, by the
+    rules of vmt.py, raising TranslationError where vmt.py exits.
+    """
+    if os.path.isfile(source):
+        inDir, inFilename = os.path.split(source)
+        filename, dot, ext = inFilename.rpartition('.')
+        if not dot or ext != 'vm':
+            raise Translator.TranslationError('Input file must have .vm extension', filename)
+        if not filename[:1].isupper():
+            raise Translator.TranslationError('Input file must start with an upper-case letter', filename)
+        return [source], os.path.join(inDir, filename + outExt)
+    if os.path.isdir(source):
+        dirName = source.rstrip(os.sep) or source
+        files = sorted(e.path for e in os.scandir(dirName) if e.is_file() and e.name.endswith('.vm'))
+        if not files:
+            raise Translator.TranslationError(f'No VM source files (*.vm) found in directory {dirName}')
+        return files, os.path.join(dirName, os.path.basename(os.path.abspath(dirName)) + outExt)
+    raise Translator.TranslationError(f'Source is invalid: {source}')
+
+def readManifest(filename: str) -> list:
+    """
+    Returns the sources listed in a manifest file, one per line, with
+    blank lines and lines starting with # left out. Relative paths are
+    taken from the manifest's directory.
+    """
+    base = os.path.dirname(filename)
+    with open(filename) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+def translatorOptions(args: argparse.Namespace) -> dict:
+    """Returns the Translator options for the code options of vmt.addCodeOptions()."""
+    return {'sharedCallReturn': args.shared_calls, 'peephole': args.peephole, 'prune': args.prune,
+            'cacheTop': args.cache_top, 'directAddressing': args.direct_addressing,
+            'localInit': args.local_init, 'localInitBudget': args.local_init_budget,
+            'inline': args.inline, 'inlineSize': args.inline_size, 'fold': args.fold,
+            'fuseBranches': args.fuse_branches, 'tailCalls': args.tail_calls}
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(
+        description='Translates many VM projects in one run, in parallel, and reports on each as JSON.')
+    argParser.add_argument('sources', nargs='*', help='Input files or directories, one project each')
+    argParser.add_argument('--manifest', action='append', default=[], metavar='FILE',
+        help='File listing more sources, one per line')
+    argParser.add_argument('-j', '--jobs', type=int, default=0,
+        help='Translate projects in parallel using this many processes (default 0 = one per CPU)')
+    argParser.add_argument('--report', default='-', metavar='FILE',
+        help='Write the JSON report to this file (default standard output)')
+    vmt.addCodeOptions(argParser)
+    args = argParser.parse_args()
+    sources = list(args.sources)
+    for manifest in args.manifest:
+        try:
+            sources += readManifest(manifest)
+        except OSError as e:
+            print(f'Error reading manifest {manifest}: {str(e)}', file=sys.stderr)
+            sys.exit(1)
+    if not sources:
+        argParser.error('no sources given')
+
+    start = time.perf_counter()
+    options = translatorOptions(args)
+    work = (sources, [options] * len(sources), [args.hack] * len(sources))
+    if args.jobs == 1 or len(sources) == 1:
+        results = list(map(translateProject, *work))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None) as pool:
+            # a few projects per task, so small projects are not dominated by the cost of a task
+            chunk = max(1, min(16, len(sources) // (4 * (args.jobs or os.cpu_count() or 1))))
+            results = list(pool.map(translateProject, *work, chunksize=chunk))
+    for result in results:
+        if result['status'] != 'ok':
+            error = result['error']
+            where = f'{error["file"]}.vm:{error["line"]}: ' if error.get('line') else ''
+            print(f'Error in {result["source"]}: {where}{error["message"]}', file=sys.stderr)
+
+    failed = sum(result['status'] != 'ok' for result in results)
+    report = {'version': vmt.VERSION, 'options': dict(options, hack=args.hack), 'projects': results,
+              'summary': {'projects': len(results), 'failed': failed,
+                          'words': sum(result['words'] for result in results),
+                          'seconds': round(time.perf_counter() - start, 4)}}
+    text = json.dumps(report, indent=2) + '\n'
+    if args.report == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.report, 'w') as f:
+            f.write(text)
+    print(f'Translated {len(results) - failed} of {len(results)} projects '
+          f'in {report["summary"]["seconds"]:.2f}s', file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
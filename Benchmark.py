@@ -0,0 +1,402 @@
+#!/usr/bin/python3
+# Benchmarks for the translator and its generated code, on synthetic VM programs.
+
+import Parser
+import Translator
+from Emulator import Emulator
+import argparse
+import gc
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+KINDS = ('arith', 'calls', 'recursive', 'files')
+
+# translator options each program is benchmarked with
+OPTION_SETS = {
+    'default': {},
+    'optimized': {'peephole': True, 'fold': True, 'fuseBranches': True, 'tailCalls': True, 'inline': True,
+                  'cacheTop': True, 'directAddressing': True, 'localInit': 'auto'},
+}
+
+ROM_SIZE = 32768
+
+BINARY = ('add', 'sub', 'and', 'or', 'eq', 'lt', 'gt')
+UNARY = ('neg', 'not')
+
+# metric -> (True if bigger is better, True if it is measured and so varies from run to run)
+METRICS = {
+    'parseLinesPerSecond': (True, True),
+    'translateLinesPerSecond': (True, True),
+    'peakKB': (False, True),
+    'words': (False, False),
+    'cycles': (False, False),
+}
+
+class ProgramGenerator:
+    """
+    Generates synthetic VM programs of about a given number of commands,
+    the same for the same seed. Every program starts at Sys.init, which
+    calls Main.main and then loops forever, so the Emulator stops there.
+    The kind of program sets the mix of code:
+    arith: functions with loops of arithmetic on locals, statics and temps.
+    calls: small leaf functions, called many times from loops.
+    recursive: recursive functions (sums, Fibonacci numbers, mutual and
+    tail recursion), so most of the time goes on calls and returns.
+    files: calls spread over many files, each with its own statics.
+    """
+
+    def __init__(self, seed: int = 0) -> None:
+        self.random = random.Random(seed)
+        self.files = {}             # file name -> lines of VM code
+        self.entries = []           # (function, nArgs) called from Main.main
+        self.size = 0               # commands generated so far
+
+    def generate(self, kind: str, size: int) -> dict:
+        """Returns {file name: VM code} for a program of kind, of about size commands."""
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind of program {kind!r}, expected one of {", ".join(KINDS)}')
+        self.files = {}
+        self.entries = []
+        self.size = 0
+        n = 0
+        while self.size < size:
+            if kind == 'arith':
+                self.loopFunction('Main', f'arith{n}', self.random.randint(0, 2), 5,
+                                  [], self.random.randint(6, 12))
+            elif kind == 'calls':
+                leaves = [self.leafFunction('Main', f'leaf{n}_{i}') for i in range(3)]
+                self.loopFunction('Main', f'caller{n}', 0, 10, leaves, 2)
+            elif kind == 'recursive':
+                self.recursiveFunctions('Main', n)
+            else:
+                file = f'Class{n}'
+                leaves = [self.leafFunction(file, f'leaf{i}') for i in range(3)]
+                if n:
+                    leaves += previous[:2]      # and some of the previous file's
+                self.loopFunction(file, 'run', 0, 4, leaves, 2)
+                previous = leaves[:3]
+            n += 1
+        main = ['function Main.main 0']
+        for function, nArgs in self.entries:
+            main += [f'push constant {self.random.randint(1, 9)}' for i in range(nArgs)]
+            main += [f'call {function} {nArgs}', 'pop temp 0']
+        main += ['push constant 0', 'return']
+        self.add('Main', main)
+        self.add('Sys', ['function Sys.init 0', 'call Main.main 0', 'pop temp 0',
+                         'label Sys.init$END', 'goto Sys.init$END'])
+        return {name: '\n'.join(lines) + '\n' for name, lines in self.files.items()}
+
+    def add(self, file: str, lines: list) -> None:
+        self.files.setdefault(file, []).extend(lines)
+        self.size += len(lines)
+
+    def operand(self, nArgs: int, nVars: int) -> str:
+        """Returns a push of a random value the function can read."""
+        r = self.random
+        segments = ['constant', 'constant', 'static', 'temp'] + ['argument'] * bool(nArgs) + ['local'] * (nVars > 1)
+        segment = r.choice(segments)
+        if segment == 'constant':
+            index = r.randrange(100)
+        elif segment == 'static':
+            index = r.randrange(4)
+        elif segment == 'temp':
+            index = r.randrange(1, 8)      # temp 0 takes the results thrown away
+        elif segment == 'argument':
+            index = r.randrange(nArgs)
+        else:
+            index = r.randrange(1, nVars)   # local 0 counts the loop
+        return f'push {segment} {index}'
+
+    def expression(self, nArgs: int, nVars: int, depth: int = 3) -> list:
+        """Returns the commands pushing the value of a random expression."""
+        r = self.random
+        if depth == 0 or r.random() < 0.3:
+            return [self.operand(nArgs, nVars)]
+        if r.random() < 0.15:
+            return self.expression(nArgs, nVars, depth - 1) + [r.choice(UNARY)]
+        return (self.expression(nArgs, nVars, depth - 1) + self.expression(nArgs, nVars, depth - 1)
+                + [r.choice(BINARY)])
+
+    def statement(self, nArgs: int, nVars: int) -> list:
+        """Returns the commands of an expression stored in a local, static or temp."""
+        r = self.random
+        target = r.choice(['static', 'temp'] + ['local'] * 2 * (nVars > 1))
+        index = {'static': r.randrange(4), 'temp': r.randrange(1, 8), 'local': r.randrange(1, max(nVars, 2))}[target]
+        return self.expression(nArgs, nVars) + [f'pop {target} {index}']
+
+    def call(self, function: str, nArgs: int, nVars: int) -> list:
+        """Returns the commands of a call with random arguments, its result added to local 1."""
+        lines = []
+        for i in range(nArgs):
+            lines += self.expression(0, nVars, 1)
+        return lines + [f'call {function} {nArgs}', 'push local 1', 'add', 'pop local 1']
+
+    def leafFunction(self, file: str, name: str) -> tuple:
+        """Adds a small function calling nothing. Returns its name and number of arguments."""
+        r = self.random
+        nArgs = r.randint(0, 3)
+        nVars = r.randint(0, 2)
+        lines = [f'function {file}.{name} {nVars}']
+        for i in range(r.randint(0, 2)):
+            lines += self.statement(nArgs, nVars)
+        lines += self.expression(nArgs, nVars, 2) + ['return']
+        self.add(file, lines)
+        return f'{file}.{name}', nArgs
+
+    def loopFunction(self, file: str, name: str, nArgs: int, iterations: int,
+                     calls: list, statements: int) -> None:
+        """
+        Adds a function looping iterations times over random statements
+        and calls to the functions in calls, and calls it from Main.main.
+        """
+        r = self.random
+        nVars = r.randint(2, 4)
+        # labels are not local to a function, so they are named after it
+        lines = [f'function {file}.{name} {nVars}',
+                 f'push constant {iterations}', 'pop local 0',
+                 f'label {file}.{name}$LOOP', 'push local 0', 'push constant 0', 'eq', f'if-goto {file}.{name}$DONE']
+        for i in range(statements):
+            lines += self.statement(nArgs, nVars)
+        for function, n in calls:
+            lines += self.call(function, n, nVars)
+        lines += ['push local 0', 'push constant 1', 'sub', 'pop local 0', f'goto {file}.{name}$LOOP',
+                  f'label {file}.{name}$DONE', 'push local 1', 'return']
+        self.add(file, lines)
+        self.entries.append((f'{file}.{name}', nArgs))
+
+    def recursiveFunctions(self, file: str, n: int) -> None:
+        """Adds a set of recursive functions and calls them from Main.main."""
+        r = self.random
+        sumTo, fib, count, even, odd = (f'{file}.{name}{n}' for name in ('sum', 'fib', 'count', 'even', 'odd'))
+        self.add(file, [
+            f'function {sumTo} 0',
+            'push argument 0', 'push constant 0', 'eq', f'if-goto {sumTo}$BASE',
+            'push argument 0', 'push argument 0', 'push constant 1', 'sub', f'call {sumTo} 1', 'add', 'return',
+            f'label {sumTo}$BASE', 'push constant 0', 'return',
+            f'function {fib} 0',
+            'push argument 0', 'push constant 2', 'lt', f'if-goto {fib}$BASE',
+            'push argument 0', 'push constant 1', 'sub', f'call {fib} 1',
+            'push argument 0', 'push constant 2', 'sub', f'call {fib} 1', 'add', 'return',
+            f'label {fib}$BASE', 'push argument 0', 'return',
+            # tail recursive, with an accumulator
+            f'function {count} 0',
+            'push argument 0', 'push constant 0', 'eq', f'if-goto {count}$BASE',
+            'push argument 0', 'push constant 1', 'sub',
+            'push argument 1', 'push argument 0', 'add', f'call {count} 2', 'return',
+            f'label {count}$BASE', 'push argument 1', 'return',
+            f'function {even} 0',
+            'push argument 0', 'push constant 0', 'eq', f'if-goto {even}$BASE',
+            'push argument 0', 'push constant 1', 'sub', f'call {odd} 1', 'return',
+            f'label {even}$BASE', 'push constant 1', 'neg', 'return',
+            f'function {odd} 0',
+            'push argument 0', 'push constant 0', 'eq', f'if-goto {odd}$BASE',
+            'push argument 0', 'push constant 1', 'sub', f'call {even} 1', 'return',
+            f'label {odd}$BASE', 'push constant 0', 'return',
+        ])
+        # the arguments Main.main pushes, kept small enough for the stack
+        runner = f'{file}.recurse{n}'
+        self.add(file, [
+            f'function {runner} 0',
+            f'push constant {r.randint(20, 100)}', f'call {sumTo} 1', 'pop static 0',
+            f'push constant {r.randint(8, 12)}', f'call {fib} 1', 'pop static 1',
+            f'push constant {r.randint(50, 150)}', 'push constant 0', f'call {count} 2', 'pop static 2',
+            f'push constant {r.randint(20, 100)}', f'call {even} 1', 'pop static 3',
+            'push static 1', 'return',
+        ])
+        self.entries.append((runner, 0))
+
+def generate(kind: str, size: int, seed: int = 0) -> dict:
+    """Returns {file name: VM code} for a synthetic program, see ProgramGenerator."""
+    return ProgramGenerator(seed).generate(kind, size)
+
+def measure(sources: dict, options: dict, repeat: int = 5, maxCycles: int = 50_000_000) -> dict:
+    """
+    Translates and runs a program. Returns its size in VM lines, the
+    parsing and translation speeds, the best of repeat runs, in VM lines
+    per second, the peak memory used by a translation, the ROM words and
+    cycles of the code, and a hash of the final values of the static
+    variables, which must not change with the options. A program too
+    big for ROM is not run.
+    """
+    vmLines = sum(len(code.splitlines()) for code in sources.values())
+    split = {name: code.splitlines() for name, code in sources.items()}
+    def parse() -> None:
+        for name, lines in split.items():
+            for cmd in Parser.Parser(name + '.vm', lines=lines, quiet=True).commands():
+                pass
+    parseSeconds = bestTime(parse, repeat)
+    translator = Translator.Translator(**options)
+    translateSeconds = bestTime(lambda: translator.translateText(sources), repeat)
+    code = translator.translateText(sources)
+    tracemalloc.start()
+    translator.translateText(sources)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        'vmLines': vmLines,
+        'parseLinesPerSecond': round(vmLines / parseSeconds),
+        'translateLinesPerSecond': round(vmLines / translateSeconds),
+        'peakKB': round(peak / 1024),
+        'words': translator.writer.words,
+        'cycles': None,             # not run if the code does not fit in ROM
+        'halted': None,
+        'statics': None,
+    }
+    if translator.writer.words <= ROM_SIZE:
+        emulator = Emulator(code.splitlines(keepends=True))
+        result['halted'] = emulator.run(maxCycles)
+        result['cycles'] = emulator.cycles
+        statics = sorted((name, emulator.ram[address]) for name, address in emulator.symbols.items()
+                         if re.fullmatch(r'\w+\.\d+', name))
+        result['statics'] = hashlib.sha256(repr(statics).encode()).hexdigest()[:16]
+    return result
+
+def bestTime(function, repeat: int, minSeconds: float = 0.02) -> float:
+    """
+    Returns the best time of function in seconds, out of repeat samples.
+    A sample calls it enough times to take at least minSeconds, as
+    short times are mostly noise. The garbage collector is off while
+    timing, as in timeit.
+    """
+    start = time.perf_counter()
+    function()
+    n = max(1, int(minSeconds / max(time.perf_counter() - start, 1e-9)))
+    best = float('inf')
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            for j in range(n):
+                function()
+            best = min(best, (time.perf_counter() - start) / n)
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return best
+
+def compare(results: dict, baseline: dict, tolerance: float, measured: bool = True) -> list:
+    """
+    Returns the regressions in results against the baseline: words or
+    cycles above it, measured speeds or memory worse by more than
+    tolerance (a fraction), unless measured is false, and changed
+    results of the program.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, (bigger, varies) in METRICS.items():
+            if metric not in base or (varies and not measured):
+                continue
+            old, new = base[metric], result[metric]
+            if old is None or new is None:
+                continue
+            allowed = tolerance * old if varies else 0
+            if (new < old - allowed) if bigger else (new > old + allowed):
+                change = 100 * (new - old) / old if old else 0
+                regressions.append(f'{name}: {metric} {old} -> {new} ({change:+.1f}%)')
+        if base.get('statics') and result['statics'] and base['statics'] != result['statics']:
+            regressions.append(f'{name}: static variables end with different values')
+        if base.get('halted') and result['halted'] is False:
+            regressions.append(f'{name}: cycle limit reached')
+    return regressions
+
+def report(results: dict, baseline: dict) -> str:
+    """Returns a table of the results, with the change from the baseline where there is one."""
+    columns = (('parse/s', 'parseLinesPerSecond', 10), ('translate/s', 'translateLinesPerSecond', 12),
+               ('peak KB', 'peakKB', 8), ('words', 'words', 8), ('cycles', 'cycles', 10))
+    change = 8 if baseline else 0   # width of ' +12.3%'
+    lines = [f'{"benchmark":<24} {"lines":>7} ' + ' '.join(f'{title:>{width + change}}' for title, metric, width in columns)]
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        cells = []
+        for title, metric, width in columns:
+            value = result[metric]
+            cell = f'{"-" if value is None else value:>{width}}'
+            if base.get(metric) and value is not None:
+                cell += f' {100 * (value - base[metric]) / base[metric]:>+6.1f}%'
+            cells.append(f'{cell:<{width + change}}')
+        lines.append(f'{name:<24} {result["vmLines"]:>7} ' + ' '.join(cells)
+                     + ('  (cycle limit reached)' if result['halted'] is False else ''))
+    return '\n'.join(lines)
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(
+        description='Benchmarks the VM translator and its generated code on synthetic programs, '
+                    'and compares the results with a stored baseline.')
+    argParser.add_argument('--kind', action='append', choices=KINDS,
+        help='Kind of program to benchmark (may be repeated, default all)')
+    argParser.add_argument('--size', type=int, default=1000,
+        help='Size of each program in VM commands (default 1000)')
+    argParser.add_argument('--seed', type=int, default=0,
+        help='Seed for the program generator (default 0)')
+    argParser.add_argument('--repeat', type=int, default=5,
+        help='Take the best of this many timings (default 5)')
+    argParser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Benchmark.json'),
+        metavar='FILE', help='Baseline results (default Benchmark.json next to this script)')
+    argParser.add_argument('--save', action='store_true',
+        help='Save the results as the new baseline instead of comparing')
+    argParser.add_argument('--tolerance', type=float, default=0.4,
+        help='Allowed slowdown or growth in memory use before it counts as a regression (default 0.4, '
+             'timings on a busy machine vary by a quarter or more)')
+    argParser.add_argument('--no-timing', action='store_true',
+        help='Only compare words, cycles and results, which do not depend on the machine')
+    argParser.add_argument('--json', metavar='FILE',
+        help='Also write the results to this file as JSON')
+    argParser.add_argument('--generate', metavar='DIR',
+        help='Write the generated programs to directories in DIR, for vmt.py, and stop')
+    args = argParser.parse_args()
+    kinds = args.kind or KINDS
+
+    programs = {f'{kind}-{args.size}': generate(kind, args.size, args.seed) for kind in kinds}
+    if args.generate:
+        for name, sources in programs.items():
+            directory = os.path.join(args.generate, name.replace('-', '_').capitalize())
+            os.makedirs(directory, exist_ok=True)
+            for file, code in sources.items():
+                with open(os.path.join(directory, file + '.vm'), 'w') as f:
+                    f.write(code)
+            print(f'Wrote {directory}', file=sys.stderr)
+        return
+
+    results = {}
+    for name, sources in programs.items():
+        for optionsName, options in OPTION_SETS.items():
+            results[f'{name}/{optionsName}'] = measure(sources, options, args.repeat)
+            print(f'Measured {name}/{optionsName}', file=sys.stderr)
+    errors = [f'{name}: static variables end with different values with options {key.split("/")[1]}'
+              for name in programs for key in results
+              if key.startswith(name + '/') and results[key]['statics'] and results[f'{name}/default']['statics']
+              and results[key]['statics'] != results[f'{name}/default']['statics']]
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print(report(results, baseline))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'size': args.size, 'seed': args.seed, 'results': results}, f, indent=2)
+            f.write('\n')
+        print(f'Saved the baseline to {args.baseline}', file=sys.stderr)
+    elif not baseline:
+        print(f'No baseline at {args.baseline}, run with --save to make one', file=sys.stderr)
+    regressions = errors + compare(results, baseline, args.tolerance, not args.no_timing)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
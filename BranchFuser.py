@@ -0,0 +1,53 @@
+from Parser import Command, CommandType
+
+# comparison -> jump condition on x - y, and the condition when the result is negated with not
+JUMPS = {'eq': ('JEQ', 'JNE'), 'lt': ('JLT', 'JGE'), 'gt': ('JGT', 'JLE')}
+
+class BranchFuser:
+    """
+    Optimization pass over the Commands from Parser, before CodeWriter.
+    A comparison, optionally followed by not, then if-goto, becomes a
+    single C_IF Command whose arg0 is the jump condition on x - y, so
+    CodeWriter can jump on the difference instead of making a boolean
+    and testing it.
+    """
+
+    def __init__(self) -> None:
+        self.removed = {'compare-if': 0}
+
+    def optimize(self, commands):
+        """Yields the optimized Commands for an iterable of Commands."""
+        pending = []                # the comparison and any not that follows it
+        for cmd in commands:
+            t = cmd.type
+            if t is CommandType.C_COMMENT:
+                yield cmd
+                continue
+            if t is CommandType.C_ARITHMETIC:
+                if cmd.arg0 in JUMPS:
+                    yield from pending
+                    pending = [cmd]
+                    continue
+                if cmd.arg0 == 'not' and len(pending) == 1:
+                    pending.append(cmd)
+                    continue
+            elif t is CommandType.C_IF and pending:
+                jump = JUMPS[pending[0].arg0][len(pending) - 1]
+                text = '; '.join(c.text.strip() for c in pending + [cmd])
+                self.removed['compare-if'] += len(pending)
+                yield Command(CommandType.C_IF, text, pending[0].line, jump, cmd.arg1)
+                pending = []
+                continue
+            yield from pending
+            pending = []
+            yield cmd
+        yield from pending
+
+    def add(self, other: 'BranchFuser') -> None:
+        """Adds the counts of another BranchFuser, e.g. one used in a worker process."""
+        for name, n in other.removed.items():
+            self.removed[name] += n
+
+    def report(self) -> str:
+        """Returns the number of VM commands fused."""
+        return f'Compare and branch: {self.removed["compare-if"]} VM commands fused into if-goto'
@@ -0,0 +1,182 @@
+import Parser
+import hashlib
+import os
+import pickle
+import sys
+
+class BuildCache:
+    """
+    On-disk cache of translated files, so that a rebuild only translates
+    the files that changed. Each entry holds the fragment returned by
+    vmt.translateFragment(), keyed by a hash of the file contents, the
+    translator version and the translation options. When the cache grows
+    past maxBytes the least recently used entries are removed.
+    """
+
+    def __init__(self, directory: str, maxBytes: int, version: str) -> None:
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.secondsSaved = 0.0     # translation time of the fragments found in the cache
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filename: str, options: dict, extra: str = '') -> str:
+        """
+        Returns the cache key for a .vm file. extra is anything else the
+        translation depends on, e.g. which of its functions are reachable.
+        """
+        h = hashlib.sha256()
+        h.update(self.contentHash(filename))
+        # the file name is part of the output (static variables, messages)
+        h.update(os.path.basename(filename).encode())
+        h.update(self.version.encode())
+        h.update(repr(sorted(options.items())).encode())
+        h.update(extra.encode())
+        return h.hexdigest()
+
+    def contentHash(self, filename: str) -> bytes:
+        """Returns a hash of a file's contents."""
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+
+    def commands(self, filename: str) -> list:
+        """Returns the parsed Commands of a .vm file. They are not kept on disk."""
+        return list(Parser.Parser(filename).commands())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.pickle')
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def get(self, key: str):
+        """Returns the cached fragment for key, or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                fragment, seconds = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'Discarding unreadable cache entry {path}: {str(e)}', file=sys.stderr)
+            os.remove(path)
+            return None
+        os.utime(path)              # mark as recently used
+        self.hits += 1
+        self.secondsSaved += seconds
+        return fragment
+
+    def put(self, key: str, fragment, seconds: float) -> None:
+        """
+        Stores a fragment that took the given time to translate. Each
+        fragment stored counts as a cache miss.
+        """
+        path = self.path(key)
+        temp = path + f'.{os.getpid()}.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump((fragment, seconds), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)      # readers never see a partial entry
+        self.misses += 1
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the cache is no
+        larger than maxBytes. Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        for e in os.scandir(self.directory):
+            if e.is_file() and e.name.endswith('.pickle'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def report(self) -> str:
+        return (f'Build cache: {self.hits} hits, {self.misses} misses, '
+                f'{self.secondsSaved:.2f}s of translation saved')
+
+class MemoryCache(BuildCache):
+    """
+    A BuildCache held in memory, for the translation server. Besides the
+    translated fragments, it keeps the hash and the parsed Commands of
+    each file until the file's modification time or size changes, so
+    unchanged files are not read again. Fragments no build needs any
+    more are removed by the server with discard().
+    """
+
+    def __init__(self, version: str) -> None:
+        self.version = version
+        self.fragments = {}         # key -> (fragment, seconds)
+        self.hashes = {}            # filename -> ((mtime, size), content hash)
+        self.parsed = {}            # filename -> ((mtime, size), Commands)
+        self.startBuild()
+
+    def startBuild(self) -> None:
+        """Resets the counts, and the entries used, for the next build."""
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.secondsSaved = 0.0
+
+    def contentHash(self, filename: str) -> bytes:
+        stamp = fileStamp(filename)
+        known = self.hashes.get(filename)
+        if known and known[0] == stamp:
+            return known[1]
+        digest = super().contentHash(filename)
+        self.hashes[filename] = (stamp, digest)
+        return digest
+
+    def commands(self, filename: str) -> list:
+        stamp = fileStamp(filename)
+        known = self.parsed.get(filename)
+        if known and known[0] == stamp:
+            return known[1]
+        commands = super().commands(filename)
+        self.parsed[filename] = (stamp, commands)
+        return commands
+
+    def contains(self, key: str) -> bool:
+        return key in self.fragments
+
+    def get(self, key: str):
+        """Returns the fragment for key, or None."""
+        entry = self.fragments.get(key)
+        if entry is None:
+            return None
+        self.used.add(key)
+        self.hits += 1
+        self.secondsSaved += entry[1]
+        return entry[0]
+
+    def put(self, key: str, fragment, seconds: float) -> None:
+        self.fragments[key] = (fragment, seconds)
+        self.used.add(key)
+        self.misses += 1
+
+    def evict(self) -> int:
+        """Nothing to do at the end of a build, the server calls discard()."""
+        return 0
+
+    def discard(self, keep: set) -> int:
+        """Removes the fragments whose keys are not in keep. Returns the number removed."""
+        unused = [key for key in self.fragments if key not in keep]
+        for key in unused:
+            del self.fragments[key]
+        return len(unused)
+
+def fileStamp(filename: str) -> tuple:
+    """Returns the modification time and size of a file, which change when it is edited."""
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
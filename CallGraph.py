@@ -0,0 +1,40 @@
+from Parser import CommandType
+
+class CallGraph:
+    """
+    The functions defined in a set of .vm files and the functions each
+    one calls, used to find the functions reachable from the program
+    entry point. Code that is not inside any function belongs to the
+    function named '' and is always reachable.
+    """
+
+    def __init__(self) -> None:
+        self.calls = {'': set()}    # function name -> names of the functions it calls
+        self.files = {}             # function name -> name of the file that defines it
+
+    def addFile(self, filename: str, commands: list) -> None:
+        """Adds the functions defined in a file, given its parsed Commands."""
+        current = ''
+        for cmd in commands:
+            if cmd.type is CommandType.C_FUNCTION:
+                current = cmd.arg1
+                self.calls.setdefault(current, set())
+                self.files[current] = filename
+            elif cmd.type is CommandType.C_CALL:
+                self.calls[current].add(cmd.arg1)
+
+    def reachable(self, entry: str = 'Sys.init') -> set:
+        """Returns the names of the functions reachable from entry."""
+        found = set()
+        pending = ['', entry]
+        while pending:
+            name = pending.pop()
+            if name in found or name not in self.calls:
+                continue
+            found.add(name)
+            pending += self.calls[name]
+        return found
+
+    def unreachable(self, entry: str = 'Sys.init') -> list:
+        """Returns the names of the functions not reachable from entry, in sorted order."""
+        return sorted(set(self.files) - self.reachable(entry))
@@ -1,19 +1,99 @@
+import Assembler
 import os
+import re
 import sys
 
+CHAIN_LIMIT = 8     # with cacheTop, segment indices below this are reached with A=A+1, keeping D
+
+# ways of setting a function's local variables to 0, see writeLocalInit()
+LOCAL_INIT = ('push', 'unroll', 'loop', 'auto')
+
 class CodeWriter:
     """
     Translates a parsed VM command into Hack assembly code.
     """
 
-    def __init__(self) -> None:
-        """Creates an empty list to hold the VM commands."""
+    def __init__(self, sharedCallReturn: bool = False, peephole = None, sourceMap: bool = False,
+                 hack: bool = False, cacheTop: bool = False, directAddressing: bool = False,
+                 localInit: str = 'push', localInitBudget: int = 8, quiet: bool = False) -> None:
+        """
+        Creates an empty list to hold the VM commands.
+        If sharedCallReturn is true, calls and returns jump to shared
+        __CALL and __RETURN routines instead of being expanded inline.
+        If a Peephole optimizer is given, it is run over the code before
+        it is written.
+        If sourceMap is true, the VM source line of each address comment
+        is recorded, for the profiler.
+        If hack is true, the output file is Hack machine code rather than
+        assembly code.
+        If cacheTop is true, the top of the stack is kept in D from one
+        command to the next where possible, and only stored to the stack
+        at labels, jumps, calls and returns.
+        If directAddressing is true, push and pop use the addresses known
+        at translation time: temp, pointer and static variables directly,
+        and small segment indices without computing base + index.
+        localInit is how a function sets its local variables to 0: 'push'
+        pushes constant 0 for each, 'unroll' stores 0 in each in a row,
+        'loop' uses a loop, and 'auto' takes the fastest way that is at
+        most localInitBudget words bigger than the smallest.
+        If quiet is true, progress messages are not printed.
+        """
         self.code = []              # lines of code are added to this list, written to output file later
         self.words = 0              # address of the next instruction to write
+        self.relocs = {}            # index in self.code -> absolute ROM address held by that A-instruction
+        self.returnRefs = []        # indices in self.code of lines using a return label
+        self.addressComments = []   # indices in self.code of '// [address]' comments
+        self.peephole = peephole
+        self.hack = hack
+        self.output = None          # when streaming: the output file or Assembler, written a chunk at a time
+        self.chunkLines = 0
+        self.base = 0               # when streaming: address of the first instruction in self.code
+        self.outWords = 0           # when streaming: instruction words written to the output file
         self.progname = ''          # for static variable names, filename only, no dir, no ext
         self.segDict = {'local':'LCL', 'argument':'ARG', 'this':'THIS', 'that':'THAT'}
         self.currentFunction = ''
         self.nReturn = 0
+        self.line = 0               # VM source line being translated, 0 for generated code
+        self.sourceMap = [] if sourceMap else None  # (progname, line) of each '// [address]' comment
+        self.commentLines = []      # if sourceMap: line numbers in the output file of the '// [address]' comments
+        self.outLines = 0           # when streaming: lines written to the output file
+        self.stats = None           # Stats counting the code as it is written, if any
+        self.sharedCallReturn = sharedCallReturn
+        self.runtimeWritten = False # shared routines are written once, after the bootstrap or at the end
+        self.nCalls = 0             # call and return sites, for the shared call/return report
+        self.nReturns = 0
+        self.callWords = 0          # words written at call and return sites
+        self.returnWords = 0
+        self.runtimeWords = 0       # words in the shared routines
+        self.cacheTop = cacheTop
+        self.topInD = False         # with cacheTop: the top of the stack is in D, not yet stored
+        self.directAddressing = directAddressing
+        self.localInit = localInit
+        self.localInitBudget = localInitBudget
+        self.localInits = {}        # way used -> [functions, local variables, words]
+        self.directCommands = {}    # (op, segment, index) -> number of push/pop commands with direct addressing
+        self.nTailCalls = 0         # tail call sites, the __TAIL routine is written if there are any
+        self.inlined = {}           # (caller, callee) -> [calls, words, nArgs] of inlined calls
+        self.inlineStart = None     # (callee, nArgs, address) of the inlined call being written
+        self.quiet = quiet
+
+    def __getstate__(self) -> dict:
+        """
+        Pickles the code as one string, which is much faster to pickle and
+        unpickle than a list of lines, for worker processes and the cache.
+        """
+        state = self.__dict__.copy()
+        state['code'] = ''.join(self.code)
+        state['nLines'] = len(self.code)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        code = state['code'].splitlines(keepends=True)
+        if len(code) != state.pop('nLines'):
+            # a comment held a character that splitlines() also treats as a line break
+            code = [line + '\n' for line in state['code'].split('\n')[:-1]]
+        state['code'] = code
+        self.__dict__.update(state)
 
     def setFilename(self, filename: str) -> None:
         """
@@ -23,10 +103,12 @@ class CodeWriter:
         b = os.path.basename(filename)
         s = b.rsplit(sep='.', maxsplit=1)
         self.progname = s[0]
-        print(f'Translating {filename} ({self.progname})', file=sys.stderr)
+        if not self.quiet:
+            print(f'Translating {filename} ({self.progname})', file=sys.stderr)
 
     def writeBootstrap(self) -> None:
-        print('Writing bootstrap code')
+        if not self.quiet:
+            print('Writing bootstrap code', file=sys.stderr)
         self.instruction( '@256')
         self.instruction( 'D=A')
         self.instruction( '@SP')
@@ -34,38 +116,132 @@ class CodeWriter:
         if not self.currentFunction:
             self.currentFunction = 'Sys.init'
         self.writeCall('call Sys.init 0', 'Sys.init', '0')
+        if self.sharedCallReturn:
+            self.writeRuntime()
 
     def writeLabel(self, cmd: str, label: str) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.spillTop()                 # a jump to the label finds the whole stack in RAM
+        self.writeAddressComment(cmd)
         # don't call self.instruction as we don't want to increment the word count
         self.code.append(f'({label})\n')
 
     def writeGoto(self, cmd: str, label: str) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        self.spillTop()
         self.instruction(f'@{label}')
         self.instruction( '0;JMP')
 
     def writeIf(self, cmd: str, label: str) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        if self.cacheTop:
+            self.fillTop()
+            self.topInD = False
+            self.instruction(f'@{label}')
+            self.instruction( 'D;JNE')
+            return
         self.instruction( '@SP')        # A = SP addr
         self.instruction( 'AM=M-1')     # SP--; A = SP
         self.instruction( 'D=M')        # D = top value from stack
         self.instruction(f'@{label}')
         self.instruction( 'D;JNE')      # jump if D is not zero
 
+    def writeCompareIf(self, cmd: str, label: str, jump: str) -> None:
+        """
+        Pops y and x and jumps to label if x - y meets the jump condition,
+        for a comparison followed by if-goto.
+        """
+        self.writeAddressComment(cmd)
+        if self.cacheTop:
+            self.fillTop()              # D = y
+            self.topInD = False
+        else:
+            self.instruction( '@SP')
+            self.instruction( 'AM=M-1')
+            self.instruction( 'D=M')    # D = y
+        self.instruction( '@SP')
+        self.instruction( 'AM=M-1')
+        self.instruction( 'D=M-D')      # D = x - y
+        self.instruction(f'@{label}')
+        self.instruction(f'D;{jump}')
+
     def writeFunction(self, cmd: str, functionName: str, nVars: int) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.spillTop()
+        self.writeAddressComment(cmd)
         self.currentFunction = functionName
         nReturn = 0
         self.code.append(f'({functionName})\n')
-        for i in range(0, nVars):
-            self.writePushPop('*initialize local variable', 'push', 'constant', 0)
+        if nVars:
+            self.writeLocalInit(nVars)
+
+    def localInitCost(self, way: str, nVars: int) -> tuple:
+        """Returns the (ROM words, cycles) for setting nVars local variables to 0 in this way."""
+        if way == 'unroll':
+            return 2 * nVars + 4, 2 * nVars + 4
+        if way == 'loop':
+            return 9, 7 * nVars + 2
+        push = CodeWriter(cacheTop=self.cacheTop)
+        for i in range(nVars):
+            push.writePushPop('', 'push', 'constant', 0)
+        push.spillTop()
+        return push.words, push.words
+
+    def writeLocalInit(self, nVars: int) -> None:
+        """Sets the local variables to 0 on entry to a function, in the way chosen by localInit."""
+        way = self.localInit
+        if way == 'auto':
+            costs = {way: self.localInitCost(way, nVars) for way in ('unroll', 'loop')}
+            smallest = min(words for words, cycles in costs.values())
+            way = min((cycles, way) for way, (words, cycles) in costs.items()
+                      if words <= smallest + self.localInitBudget)[1]
+        start = self.words
+        if way == 'unroll':
+            self.writeAddressComment(f'*initialize {nVars} local variables')
+            self.instruction( '@SP')
+            self.instruction( 'A=M')
+            self.instruction( 'M=0')
+            for i in range(1, nVars):
+                self.instruction( 'A=A+1')
+                self.instruction( 'M=0')
+            self.instruction( 'D=A+1')
+            self.instruction( '@SP')
+            self.instruction( 'M=D')
+        elif way == 'loop':
+            self.writeAddressComment(f'*initialize {nVars} local variables in a loop')
+            self.instruction(f'@{nVars}')
+            self.instruction( 'D=A')
+            loop = self.words
+            self.instruction( '@SP')
+            self.instruction( 'AM=M+1')
+            self.instruction( 'A=A-1')
+            self.instruction( 'M=0')
+            self.instruction( 'D=D-1')
+            self.absolute(loop)
+            self.instruction( 'D;JGT')
+        else:
+            for i in range(0, nVars):
+                self.writePushPop('*initialize local variable', 'push', 'constant', 0)
+        total = self.localInits.setdefault(way, [0, 0, 0])
+        total[0] += 1
+        total[1] += nVars
+        total[2] += self.words - start
+
+    def localInitReport(self) -> str:
+        """Returns the number of functions using each way of setting local variables to 0."""
+        lines = ['Local variable initialization:']
+        for way, (functions, nVars, words) in sorted(self.localInits.items()):
+            lines.append(f'  {way:<8} {functions:6} functions {nVars:7} variables {words:7} words')
+        return '\n'.join(lines)
 
     def writeCall(self, cmd: str, functionName: str, nArgs: int) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        self.spillTop()
         returnLabel = f'{self.currentFunction}$ret.{self.nReturn}'
         self.nReturn += 1
+        if self.sharedCallReturn:
+            self.writeSharedCall(functionName, nArgs, returnLabel)
+            return
         # push return addr
+        self.returnRefs.append(len(self.code))
         self.instruction(f'@{returnLabel}')
         self.instruction( 'D=A')
         self.pushD()
@@ -96,10 +272,18 @@ class CodeWriter:
         self.instruction(f'@{functionName}')
         self.instruction( '0;JMP')
         # return label
+        self.returnRefs.append(len(self.code))
         self.code.append(f'({returnLabel})\n')
 
     def writeReturn(self, cmd: str) -> None:
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        self.spillTop()
+        if self.sharedCallReturn:
+            self.nReturns += 1
+            self.returnWords += 2
+            self.instruction( '@__RETURN')
+            self.instruction( '0;JMP')
+            return
         # save LCL in R14
         self.instruction( '@LCL')
         self.instruction( 'D=M')
@@ -136,12 +320,446 @@ class CodeWriter:
         self.instruction( '@R13')
         self.instruction( 'A=M')
         self.instruction( '0;JMP')
+
+    def writeTailCall(self, cmd: str, functionName: str, nArgs: int) -> None:
+        """
+        A call followed by return, from TailCaller: the called function
+        takes over the current frame and returns to our caller. If the
+        current function also has nArgs arguments, the arguments are
+        copied down over ours and the frame stays where it is. Otherwise
+        the __TAIL routine moves the frame as well.
+        """
+        self.writeAddressComment(cmd)
+        self.spillTop()
+        self.nTailCalls += 1
+        # LCL - ARG = nArgs + 5 if the frame can stay
+        self.instruction( '@LCL')
+        self.instruction( 'D=M')
+        self.instruction( '@ARG')
+        self.instruction( 'D=D-M')
+        self.instruction(f'@{nArgs + 5}')
+        self.instruction( 'D=D-A')
+        self.absolute(self.words + 13)
+        self.instruction( 'D;JEQ')
+        # function address to *SP, nArgs to R13 for __TAIL
+        self.instruction(f'@{functionName}')
+        self.instruction( 'D=A')
+        self.instruction( '@SP')
+        self.instruction( 'A=M')
+        self.instruction( 'M=D')
+        self.instruction(f'@{nArgs}')
+        self.instruction( 'D=A')
+        self.instruction( '@R13')
+        self.instruction( 'M=D')
+        self.instruction( '@__TAIL')
+        self.instruction( '0;JMP')
+        # copy the arguments to ARG[0..nArgs-1]
+        for i in range(nArgs):
+            self.instruction( '@SP')
+            if nArgs - i == 1:
+                self.instruction( 'A=M-1')
+            else:
+                self.instruction( 'D=M')
+                self.instruction(f'@{nArgs - i}')
+                self.instruction( 'A=D-A')
+            self.instruction( 'D=M')
+            if i < CHAIN_LIMIT:
+                self.instruction( '@ARG')
+                self.instruction( 'A=M' if i == 0 else 'A=M+1')
+                for n in range(1, i):
+                    self.instruction( 'A=A+1')
+            else:
+                self.instruction( '@R13')
+                self.instruction( 'M=D')
+                self.instruction(f'@{i}')
+                self.instruction( 'D=A')
+                self.instruction( '@ARG')
+                self.instruction( 'D=D+M')
+                self.instruction( '@R14')
+                self.instruction( 'M=D')
+                self.instruction( '@R13')
+                self.instruction( 'D=M')
+                self.instruction( '@R14')
+                self.instruction( 'A=M')
+            self.instruction( 'M=D')
+        # SP = LCL, ARG and LCL stay as they are
+        self.instruction( '@LCL')
+        self.instruction( 'D=M')
+        self.instruction( '@SP')
+        self.instruction( 'M=D')
+        self.instruction(f'@{functionName}')
+        self.instruction( '0;JMP')
+
+    def writeTailRuntime(self) -> None:
+        """
+        Writes the __TAIL routine, for tail calls where the called function
+        has a different number of arguments than the current one, so the
+        frame has to move. R13 = nArgs, *SP = the function's address.
+        """
+        self.writeAddressComment('*tail call routine')
+        self.code.append('(__TAIL)\n')
+        # copy the frame, LCL-5 to LCL-1, to SP+1 to SP+5, out of the way
+        for k in range(5):
+            self.instruction( '@LCL')
+            self.instruction( 'D=M')
+            self.instruction(f'@{5 - k}')
+            self.instruction( 'A=D-A')
+            self.instruction( 'D=M')
+            self.instruction( '@SP')
+            self.instruction( 'A=M+1')
+            for n in range(k):
+                self.instruction( 'A=A+1')
+            self.instruction( 'M=D')
+        # copy the arguments from SP-nArgs (R15) to ARG (R14), upwards
+        self.instruction( '@SP')
+        self.instruction( 'D=M')
+        self.instruction( '@R13')
+        self.instruction( 'D=D-M')
+        self.instruction( '@R15')
+        self.instruction( 'M=D')
+        self.instruction( '@ARG')
+        self.instruction( 'D=M')
+        self.instruction( '@R14')
+        self.instruction( 'M=D')
+        self.code.append('(__TAIL_ARGS)\n')
+        self.instruction( '@R13')
+        self.instruction( 'MD=M-1')
+        self.instruction( '@__TAIL_FRAME')
+        self.instruction( 'D;JLT')
+        self.instruction( '@R15')
+        self.instruction( 'M=M+1')
+        self.instruction( 'A=M-1')
+        self.instruction( 'D=M')
+        self.instruction( '@R14')
+        self.instruction( 'M=M+1')
+        self.instruction( 'A=M-1')
+        self.instruction( 'M=D')
+        self.instruction( '@__TAIL_ARGS')
+        self.instruction( '0;JMP')
+        # copy the frame after the arguments
+        self.code.append('(__TAIL_FRAME)\n')
+        for k in range(5):
+            self.instruction( '@SP')
+            self.instruction( 'A=M+1')
+            for n in range(k):
+                self.instruction( 'A=A+1')
+            self.instruction( 'D=M')
+            self.instruction( '@R14')
+            self.instruction( 'A=M')
+            for n in range(k):
+                self.instruction( 'A=A+1')
+            self.instruction( 'M=D')
+        # LCL = SP = end of the frame, ARG stays, then go to the function
+        self.instruction( '@SP')
+        self.instruction( 'A=M')
+        self.instruction( 'D=M')
+        self.instruction( '@R13')
+        self.instruction( 'M=D')
+        self.instruction( '@R14')
+        self.instruction( 'D=M')
+        self.instruction( '@5')
+        self.instruction( 'D=D+A')
+        self.instruction( '@LCL')
+        self.instruction( 'M=D')
+        self.instruction( '@SP')
+        self.instruction( 'M=D')
+        self.instruction( '@R13')
+        self.instruction( 'A=M')
+        self.instruction( '0;JMP')
+
+    def writeInlineCall(self, cmd: str, functionName: str, nArgs: int) -> None:
+        """
+        Starts a call replaced by the function body, by Inliner. The
+        arguments stay where they are, as the start of the inline frame.
+        """
+        self.writeAddressComment(f'{cmd} (inlined)')
+        self.inlineStart = (functionName, nArgs, self.words)
+
+    def writeInlineReturn(self, cmd: str, frame: int, last: bool) -> None:
+        """
+        A return from an inlined function body: the return value replaces
+        the first argument, frame values down the stack, and the values
+        above it are dropped. If last is true, this ends the inlined call.
+        """
+        self.writeAddressComment(f'{cmd} (inlined)')
+        if frame > 1:
+            if self.cacheTop:
+                # the value stays in D, only SP moves down
+                self.fillTop()
+                if frame - 1 < CHAIN_LIMIT:
+                    self.instruction( '@SP')
+                    for i in range(frame - 1):
+                        self.instruction( 'M=M-1')
+                else:
+                    self.instruction( '@R15')
+                    self.instruction( 'M=D')
+                    self.instruction(f'@{frame - 1}')
+                    self.instruction( 'D=A')
+                    self.instruction( '@SP')
+                    self.instruction( 'M=M-D')
+                    self.instruction( '@R15')
+                    self.instruction( 'D=M')
+            else:
+                if frame - 1 < CHAIN_LIMIT:
+                    self.instruction( '@SP')
+                    self.instruction( 'AM=M-1')
+                    self.instruction( 'D=M')
+                    for i in range(frame - 1):
+                        self.instruction( 'A=A-1')
+                else:
+                    self.instruction( '@SP')
+                    self.instruction( 'D=M')
+                    self.instruction(f'@{frame}')
+                    self.instruction( 'D=D-A')
+                    self.instruction( '@R15')
+                    self.instruction( 'M=D')
+                    self.instruction( '@SP')
+                    self.instruction( 'A=M-1')
+                    self.instruction( 'D=M')
+                    self.instruction( '@R15')
+                    self.instruction( 'A=M')
+                self.instruction( 'M=D')
+                # SP = address of the return value + 1
+                self.instruction( 'D=A+1')
+                self.instruction( '@SP')
+                self.instruction( 'M=D')
+        if last and self.inlineStart:
+            functionName, nArgs, start = self.inlineStart
+            total = self.inlined.setdefault((self.currentFunction, functionName), [0, 0, nArgs])
+            total[0] += 1
+            total[1] += self.words - start
+            self.inlineStart = None
+
+    def writeFramePushPop(self, op: str, offset: int) -> None:
+        """
+        Push or pop for the 'frame' segment of an inlined function body:
+        the variable is offset words below SP, counting SP before the
+        command and the top of the stack even if it is held in D.
+        """
+        if op == 'push':
+            self.spillTop()
+            self.instruction( '@SP')
+            if offset == 1:
+                self.instruction( 'A=M-1')
+            else:
+                self.instruction( 'D=M')
+                self.instruction(f'@{offset}')
+                self.instruction( 'A=D-A')
+            self.instruction( 'D=M')
+            if self.cacheTop:
+                self.topInD = True
+            else:
+                self.pushD()
+        elif offset - 1 < CHAIN_LIMIT:
+            # once the value is popped, the variable is offset - 1 below the stack pointer
+            if self.cacheTop:
+                self.fillTop()
+                self.topInD = False
+                self.instruction( '@SP')
+                self.instruction( 'A=M')
+            else:
+                self.instruction( '@SP')
+                self.instruction( 'AM=M-1')
+                self.instruction( 'D=M')
+            for i in range(offset - 1):
+                self.instruction( 'A=A-1')
+            self.instruction( 'M=D')
+        else:
+            self.spillTop()
+            self.instruction( '@SP')
+            self.instruction( 'D=M')
+            self.instruction(f'@{offset}')
+            self.instruction( 'D=D-A')
+            self.instruction( '@R15')
+            self.instruction( 'M=D')
+            self.pop15()
+
+    def writeSharedCall(self, functionName: str, nArgs: int, returnLabel: str) -> None:
+        """
+        Writes a call site for the shared __CALL routine: R13 = nArgs,
+        R14 = function address, D = return address.
+        """
+        start = self.words
+        self.nCalls += 1
+        if int(nArgs) in (0, 1):
+            self.instruction( '@R13')
+            self.instruction(f'M={nArgs}')
+        else:
+            self.instruction(f'@{nArgs}')
+            self.instruction( 'D=A')
+            self.instruction( '@R13')
+            self.instruction( 'M=D')        # R13 = nArgs
+        self.instruction(f'@{functionName}')
+        self.instruction( 'D=A')
+        self.instruction( '@R14')
+        self.instruction( 'M=D')            # R14 = function address
+        self.returnRefs.append(len(self.code))
+        self.instruction(f'@{returnLabel}')
+        self.instruction( 'D=A')            # D = return address
+        self.instruction( '@__CALL')
+        self.instruction( '0;JMP')
+        self.returnRefs.append(len(self.code))
+        self.code.append(f'({returnLabel})\n')
+        self.callWords += self.words - start
+
+    def writeRuntime(self) -> None:
+        """
+        Writes the shared __CALL and __RETURN routines used when
+        sharedCallReturn is set. Control never falls into them: they
+        follow the bootstrap's call to Sys.init, or the infinite loop
+        at the end of the program.
+        """
+        start = self.words
+        self.runtimeWritten = True
+        self.writeAddressComment('*shared call routine')
+        self.code.append('(__CALL)\n')
+        self.pushD()                        # push return addr
+        # push memory segment pointers
+        for s in ['LCL', 'ARG', 'THIS', 'THAT']:
+            self.instruction(f'@{s}')
+            self.instruction( 'D=M')
+            self.pushD()
+        # LCL = SP, ARG = SP - 5 - nArgs
+        self.instruction( '@SP')
+        self.instruction( 'D=M')
+        self.instruction( '@LCL')
+        self.instruction( 'M=D')
+        self.instruction( '@R13')
+        self.instruction( 'D=D-M')
+        self.instruction( '@5')
+        self.instruction( 'D=D-A')
+        self.instruction( '@ARG')
+        self.instruction( 'M=D')
+        # transfer to the function
+        self.instruction( '@R14')
+        self.instruction( 'A=M')
+        self.instruction( '0;JMP')
+
+        self.writeAddressComment('*shared return routine')
+        self.code.append('(__RETURN)\n')
+        # save LCL in R14, return addr in R13
+        self.instruction( '@LCL')
+        self.instruction( 'D=M')
+        self.instruction( '@R14')
+        self.instruction( 'M=D')
+        self.instruction( '@5')
+        self.instruction( 'A=D-A')
+        self.instruction( 'D=M')
+        self.instruction( '@R13')
+        self.instruction( 'M=D')
+        # copy the return value to the top of the caller's stack
+        self.instruction( '@SP')
+        self.instruction( 'AM=M-1')
+        self.instruction( 'D=M')
+        self.instruction( '@ARG')
+        self.instruction( 'A=M')
+        self.instruction( 'M=D')
+        # reposition SP for caller
+        self.instruction( '@ARG')
+        self.instruction( 'D=M+1')
+        self.instruction( '@SP')
+        self.instruction( 'M=D')
+        # THAT = *(frame-1), THIS = *(frame-2), ARG = *(frame-3), LCL = *(frame-4)
+        for i in range(4, 0, -1):
+            self.instruction( '@R14')
+            self.instruction( 'AM=M-1')
+            self.instruction( 'D=M')
+            self.instruction(f'@{i}')
+            self.instruction( 'M=D')
+        # go to the return address
+        self.instruction( '@R13')
+        self.instruction( 'A=M')
+        self.instruction( '0;JMP')
+        self.runtimeWords += self.words - start
+
+    def sharedCallReport(self) -> str:
+        """
+        Returns a summary of the ROM words saved by using the shared
+        call/return routines, compared with inline expansion.
+        """
+        inline = CodeWriter()
+        inline.writeCall('', 'f', 0)
+        inlineCall = inline.words
+        inline.writeReturn('')
+        inlineReturn = inline.words - inlineCall
+        saved = (self.nCalls * inlineCall - self.callWords
+                 + self.nReturns * inlineReturn - self.returnWords
+                 - self.runtimeWords)
+        return (f'Shared call/return: {self.nCalls} calls, {self.nReturns} returns, '
+                f'{self.runtimeWords} words of routines, {saved} ROM words saved')
+
+    def inlineReport(self) -> str:
+        """
+        Returns the calls replaced by function bodies and the ROM words
+        they added, compared with the call sequence they replaced.
+        """
+        lines = []
+        totalCalls = totalGrowth = 0
+        for (caller, callee), (calls, words, nArgs) in sorted(self.inlined.items()):
+            call = CodeWriter(sharedCallReturn=self.sharedCallReturn)
+            call.writeCall('', callee, nArgs)
+            growth = words - calls * call.words
+            totalCalls += calls
+            totalGrowth += growth
+            lines.append(f'  {callee} in {caller}: {calls} calls, {growth:+} ROM words')
+        return '\n'.join([f'Inlined {totalCalls} calls, {totalGrowth:+} ROM words'] + lines)
+
+    def link(self, other: 'CodeWriter') -> None:
+        """
+        Appends the code of another CodeWriter, which translated a file
+        separately starting at address 0 and return label number 0.
+        Absolute addresses, address comments and return label numbers
+        are adjusted to follow the code already written.
+        """
+        base = self.words
+        first = len(self.code)
+        returnBase = self.nReturn
+        renumber = lambda m: f'$ret.{int(m.group(1)) + returnBase}'
+        self.code += other.code
+        for i, address in other.relocs.items():
+            self.relocs[first + i] = address + base
+            self.code[first + i] = f'  @{address + base}\n'
+        for i in other.returnRefs:
+            self.returnRefs.append(first + i)
+            self.code[first + i] = re.sub(r'\$ret\.(\d+)', renumber, other.code[i])
+        code = self.code
+        for i in other.addressComments:
+            line = other.code[i]
+            end = line.index(']', 4)
+            code[first + i] = f'// [{int(line[4:end]) + base}{line[end:]}'
+        self.addressComments += [first + i for i in other.addressComments]
+        if self.sourceMap is not None:
+            self.sourceMap += other.sourceMap
+        self.words += other.words
+        self.nReturn += other.nReturn
+        self.nCalls += other.nCalls
+        self.nReturns += other.nReturns
+        self.callWords += other.callWords
+        self.returnWords += other.returnWords
+        self.nTailCalls += other.nTailCalls
+        for way, counts in other.localInits.items():
+            total = self.localInits.setdefault(way, [0, 0, 0])
+            for i, n in enumerate(counts):
+                total[i] += n
+        for key, n in other.directCommands.items():
+            self.directCommands[key] = self.directCommands.get(key, 0) + n
+        for key, (calls, words, nArgs) in other.inlined.items():
+            total = self.inlined.setdefault(key, [0, 0, nArgs])
+            total[0] += calls
+            total[1] += words
+        self.currentFunction = other.currentFunction
+        if self.output and len(self.code) >= self.chunkLines:
+            self.flush()
+
     def writeArithmetic(self, cmd: str, op: str) -> None:
         """
         Appends the code for the given arithmetic or logical command
         to the VM code list.
         """
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        if self.cacheTop:
+            self.writeCachedArithmetic(op)
+            return
         if op == 'add':
             self.instruction( '@SP')
             self.instruction( 'AM=M-1')
@@ -176,18 +794,26 @@ class CodeWriter:
             self.instruction( 'A=M')
             self.instruction( 'A=A-1')
             self.instruction( 'M=!M')
+        elif op == 'inc':                   # from ConstantFolder: push constant 1, add
+            self.instruction( '@SP')
+            self.instruction( 'A=M-1')
+            self.instruction( 'M=M+1')
+        elif op == 'dec':                   # from ConstantFolder: push constant 1, sub
+            self.instruction( '@SP')
+            self.instruction( 'A=M-1')
+            self.instruction( 'M=M-1')
         elif op == 'eq':
             self.instruction( '@SP')        # A = SP addr
             self.instruction( 'AM=M-1')     # SP--; A = SP
             self.instruction( 'D=M')        # D = y
             self.instruction( 'A=A-1')      # M = x
             self.instruction( 'D=M-D')      # result in D
-            self.instruction(f'@{self.words+7}')
+            self.absolute(self.words+7)
             self.instruction( 'D;JEQ')      # jump if D is zero, i.e. x==y
             self.instruction( '@SP')        # x<>y so put false (0) on the stack
             self.instruction( 'A=M-1')
             self.instruction( 'M=0')
-            self.instruction(f'@{self.words+5}')
+            self.absolute(self.words+5)
             self.instruction( '0;JMP')
             self.instruction( '@SP')        # x==y so put true (-1) on the stack
             self.instruction( 'A=M-1')
@@ -198,12 +824,12 @@ class CodeWriter:
             self.instruction( 'D=M')        # D = y
             self.instruction( 'A=A-1')      # M = x
             self.instruction( 'D=M-D')      # result in D
-            self.instruction(f'@{self.words+7}')
+            self.absolute(self.words+7)
             self.instruction( 'D;JLT')      # jump if D < zero, i.e. x<y
             self.instruction( '@SP')        # x>=y so put false (0) on the stack
             self.instruction( 'A=M-1')
             self.instruction( 'M=0')
-            self.instruction(f'@{self.words+5}')
+            self.absolute(self.words+5)
             self.instruction( '0;JMP')
             self.instruction( '@SP')        # x<y so put true (-1) on the stack
             self.instruction( 'A=M-1')
@@ -214,12 +840,12 @@ class CodeWriter:
             self.instruction( 'D=M')        # D = y
             self.instruction( 'A=A-1')      # M = x
             self.instruction( 'D=M-D')      # result in D
-            self.instruction(f'@{self.words+7}')
+            self.absolute(self.words+7)
             self.instruction( 'D;JGT')      # jump if D > zero, i.e. x>y
             self.instruction( '@SP')        # x<=y so put false (0) on the stack
             self.instruction( 'A=M-1')
             self.instruction( 'M=0')
-            self.instruction(f'@{self.words+5}')
+            self.absolute(self.words+5)
             self.instruction( '0;JMP')
             self.instruction( '@SP')        # x>y so put true (-1) on the stack
             self.instruction( 'A=M-1')
@@ -227,7 +853,16 @@ class CodeWriter:
 
     def writePushPop(self, cmd: str, op: str, segment: str, index: str) -> None:
         """Appends the code for a push or pop command to the VM code list."""
-        self.writeComment(f'// [{self.words}] {cmd}')
+        self.writeAddressComment(cmd)
+        if segment == 'frame':
+            self.writeFramePushPop(op, index)
+            return
+        if self.cacheTop:
+            self.writeCachedPushPop(op, segment, index)
+            return
+        if self.directAddressing and segment != 'constant':
+            self.writeDirectPushPop(op, segment, int(index))
+            return
         if op == 'push':
             if segment == 'constant':
                 self.instruction(f'@{index}')       # get value to push in D
@@ -292,11 +927,199 @@ class CodeWriter:
                 self.instruction( 'M=D')            # save in R15
                 self.pop15()
 
+    def writeDirectPushPop(self, op: str, segment: str, i: int) -> None:
+        """
+        Push or pop with directAddressing: temp, pointer and static are
+        used by address, segment indices below 2 (push) or CHAIN_LIMIT
+        (pop) are reached with A=M+1 and A=A+1, and pop finds the
+        address after taking the value off the stack, so R15 is not used.
+        """
+        key = (op, segment, i)
+        self.directCommands[key] = self.directCommands.get(key, 0) + 1
+        if op == 'push':
+            if segment in self.segDict:
+                if i <= 1:
+                    self.instruction(f'@{self.segDict[segment]}')
+                    self.instruction( 'A=M' if i == 0 else 'A=M+1')
+                else:
+                    self.instruction(f'@{i}')
+                    self.instruction( 'D=A')
+                    self.instruction(f'@{self.segDict[segment]}')
+                    self.instruction( 'A=D+M')
+            else:
+                self.instruction(f'@{self.fixedAddress(segment, i)}')
+            self.instruction( 'D=M')
+            self.pushD()
+        elif op == 'pop':
+            if segment in self.segDict and i >= CHAIN_LIMIT:
+                self.instruction(f'@{i}')
+                self.instruction( 'D=A')
+                self.instruction(f'@{self.segDict[segment]}')
+                self.instruction( 'D=D+M')
+                self.instruction( '@R15')
+                self.instruction( 'M=D')
+                self.pop15()
+                return
+            self.instruction( '@SP')
+            self.instruction( 'AM=M-1')
+            self.instruction( 'D=M')
+            if segment in self.segDict:
+                self.instruction(f'@{self.segDict[segment]}')
+                self.instruction( 'A=M' if i == 0 else 'A=M+1')
+                for n in range(1, i):
+                    self.instruction( 'A=A+1')
+            else:
+                self.instruction(f'@{self.fixedAddress(segment, i)}')
+            self.instruction( 'M=D')
+
+    def addressingReport(self, executions: dict = None) -> str:
+        """
+        Returns the ROM words saved by direct addressing for each segment,
+        compared with computing the address. Each push or pop is straight
+        line code, so a word saved is also a cycle saved each time it runs.
+        If executions gives the times each (op, segment, index) ran, the
+        cycles saved are included.
+        """
+        totals = {}                 # segment -> [commands, words saved, cycles saved]
+        for (op, segment, i), n in self.directCommands.items():
+            computed = CodeWriter()
+            computed.writePushPop('', op, segment, i)
+            direct = CodeWriter(directAddressing=True)
+            direct.writePushPop('', op, segment, i)
+            saved = computed.words - direct.words
+            total = totals.setdefault(segment, [0, 0, 0])
+            total[0] += n
+            total[1] += n * saved
+            if executions:
+                total[2] += executions.get((op, segment, i), 0) * saved
+        lines = [f'Direct addressing: {sum(t[0] for t in totals.values())} push/pop commands, '
+                 f'{sum(t[1] for t in totals.values())} ROM words saved'
+                 + (f', {sum(t[2] for t in totals.values())} cycles saved' if executions else '')]
+        for segment, (n, words, cycles) in sorted(totals.items()):
+            lines.append(f'  {segment:<10} {n:6} commands {words:7} words' + (f' {cycles:10} cycles' if executions else ''))
+        return '\n'.join(lines)
+
+    def writeCachedArithmetic(self, op: str) -> None:
+        """
+        Arithmetic with cacheTop: the result is left in D, and the stack
+        in RAM holds everything below it.
+        """
+        unary = {'neg': '-{}', 'not': '!{}', 'inc': '{}+1', 'dec': '{}-1'}
+        if op in unary:
+            if self.topInD:
+                self.instruction( 'D=' + unary[op].format('D'))
+            else:
+                self.instruction( '@SP')
+                self.instruction( 'A=M-1')
+                self.instruction( 'M=' + unary[op].format('M'))
+            return
+        self.fillTop()                  # D = y
+        self.instruction( '@SP')
+        self.instruction( 'AM=M-1')     # SP--; M = x
+        if op == 'add':
+            self.instruction( 'D=D+M')
+        elif op == 'sub':
+            self.instruction( 'D=M-D')
+        elif op == 'and':
+            self.instruction( 'D=D&M')
+        elif op == 'or':
+            self.instruction( 'D=D|M')
+        else:
+            jump = {'eq': 'JEQ', 'lt': 'JLT', 'gt': 'JGT'}[op]
+            self.instruction( 'D=M-D')
+            self.absolute(self.words+5)
+            self.instruction(f'D;{jump}')
+            self.instruction( 'D=0')        # false
+            self.absolute(self.words+3)
+            self.instruction( '0;JMP')
+            self.instruction( 'D=-1')       # true
+
+    def writeCachedPushPop(self, op: str, segment: str, index: str) -> None:
+        """
+        Push or pop with cacheTop: a push loads the value into D, first
+        storing any value already there, and a pop stores D.
+        """
+        i = int(index)
+        if op == 'push':
+            self.spillTop()
+            self.topInD = True
+            if segment == 'constant':
+                if i <= 1:
+                    self.instruction(f'D={i}')
+                else:
+                    self.instruction(f'@{i}')
+                    self.instruction( 'D=A')
+            elif segment in self.segDict:
+                if i <= 1:
+                    self.instruction(f'@{self.segDict[segment]}')
+                    self.instruction( 'A=M' if i == 0 else 'A=M+1')
+                else:
+                    self.instruction(f'@{i}')
+                    self.instruction( 'D=A')
+                    self.instruction(f'@{self.segDict[segment]}')
+                    self.instruction( 'A=D+M')
+                self.instruction( 'D=M')
+            else:
+                self.instruction(f'@{self.fixedAddress(segment, i)}')
+                self.instruction( 'D=M')
+        elif op == 'pop':
+            if segment in self.segDict and i >= CHAIN_LIMIT:
+                # too far to reach without using D: pop the usual way
+                self.spillTop()
+                self.instruction(f'@{i}')
+                self.instruction( 'D=A')
+                self.instruction(f'@{self.segDict[segment]}')
+                self.instruction( 'D=D+M')
+                self.instruction( '@R15')
+                self.instruction( 'M=D')
+                self.pop15()
+                return
+            self.fillTop()
+            self.topInD = False
+            if segment in self.segDict:
+                self.instruction(f'@{self.segDict[segment]}')
+                self.instruction( 'A=M' if i == 0 else 'A=M+1')
+                for n in range(1, i):
+                    self.instruction( 'A=A+1')
+            else:
+                self.instruction(f'@{self.fixedAddress(segment, i)}')
+            self.instruction( 'M=D')
+
+    def fixedAddress(self, segment: str, index: int) -> str:
+        """Returns the address of a temp, pointer or static variable, as an A-instruction operand."""
+        if segment == 'temp':
+            return str(5 + index)       # TEMP is RAM[5-12]
+        elif segment == 'pointer':
+            return str(3 + index)       # POINTER is RAM[3-4]
+        return f'{self.progname}.{index}'
+
+    def fillTop(self) -> None:
+        """With cacheTop, pops the top of the stack into D unless it is there already."""
+        if not self.topInD:
+            self.instruction('@SP')
+            self.instruction('AM=M-1')
+            self.instruction('D=M')
+            self.topInD = True
+
+    def spillTop(self) -> None:
+        """With cacheTop, pushes the top of the stack held in D, so all of the stack is in RAM."""
+        if self.topInD:
+            self.pushD()
+            self.topInD = False
+
     def instruction(self, inst: str) -> None:
         """Writes a single instruction and increments the word count."""
         self.code.append('  ' + inst + '\n')
         self.words += 1
 
+    def absolute(self, address: int) -> None:
+        """
+        Writes an A-instruction holding an absolute ROM address, and
+        records it so the address can be adjusted if code is moved.
+        """
+        self.relocs[len(self.code)] = address
+        self.instruction(f'@{address}')
+
     def pushD(self) -> None:
         """Pushes the contents of D onto the stack."""
         self.instruction('@SP')         # A = SP address
@@ -319,17 +1142,103 @@ class CodeWriter:
         Appends the input line as is to the VM code list.
         Use for comments, blank lines.
         """
+        if self.output and len(self.code) >= self.chunkLines:
+            self.flush()
         self.code.append(cmd + '\n')
 
+    def writeAddressComment(self, cmd: str) -> None:
+        """
+        Appends a '// [address] cmd' comment for the code that follows,
+        and records it, so the address can be adjusted when the code is
+        moved and the code can be mapped back to the VM command. Only
+        these comments are taken for address comments: VM comments
+        written by writeComment() may look the same.
+        """
+        if self.output and len(self.code) >= self.chunkLines:
+            self.flush()
+        self.addressComments.append(len(self.code))
+        if self.sourceMap is not None:
+            self.sourceMap.append((self.progname, self.line))
+        self.code.append(f'// [{self.words}] {cmd}\n')
+
+    def stream(self, outFilename: str, chunkLines: int = 8192, output = None) -> None:
+        """
+        Writes the code to outFilename in chunks of about chunkLines lines
+        as it is generated, instead of keeping it all until close().
+        Any code already written (e.g. the bootstrap) goes first.
+        If output is given, any object with writelines() and close(), the
+        code is written to it instead.
+        """
+        if output is not None:
+            self.output = output
+        else:
+            self.output = Assembler.Assembler(outFilename) if self.hack else open(outFilename, 'w')
+        self.chunkLines = chunkLines
+
+    def flush(self) -> None:
+        """
+        Writes the code so far to the output file and empties the code
+        list. The peephole optimizer, if any, is run on each chunk.
+        """
+        if self.peephole:
+            relocs = {i: address - self.base for i, address in self.relocs.items()}
+            code, relocs, comments, words = self.peephole.optimize(self.code, relocs, self.addressComments,
+                                                                   self.outWords)
+        else:
+            code, comments, words = self.code, self.addressComments, self.words - self.base
+        self.written(code, comments)
+        self.output.writelines(code)
+        self.outWords += words
+        self.base = self.words
+        self.code = []
+        self.relocs = {}
+        self.returnRefs = []
+        self.addressComments = []
+
+    def written(self, code: list, comments: list) -> None:
+        """
+        Records final code on its way to the output, with comments the
+        indices in it of the address comments: counts it in the Stats,
+        and notes the output lines of the comments for the source map.
+        """
+        if self.stats:
+            self.stats.addCode(code, comments)
+        if self.sourceMap is not None:
+            self.commentLines += [self.outLines + i for i in comments]
+        self.outLines += len(code)
+
     def close(self, outFilename: str) -> None:
         """
         Adds an infinite loop to the end of the output file to
         stop execution, and closes the file.
         """
-        self.code.append(f'// [{self.words}] *infinite loop\n')
+        self.spillTop()
+        if self.output:
+            # addresses from here on are not optimized, so count from what was written
+            self.flush()
+            self.words = self.base = self.outWords
+        elif self.peephole:
+            self.code, self.relocs, self.addressComments, self.words = self.peephole.optimize(
+                self.code, self.relocs, self.addressComments)
+        self.line = 0
+        self.writeAddressComment('*infinite loop')
         self.code.append('(__FINIS__)\n')
-        self.code.append('  @__FINIS__\n')
-        self.code.append('  0;JMP\n')
+        self.instruction('@__FINIS__')
+        self.instruction('0;JMP')
+        if self.sharedCallReturn and not self.runtimeWritten and (self.nCalls or self.nReturns):
+            self.writeRuntime()
+        if self.nTailCalls:
+            self.writeTailRuntime()
 
-        with open(outFilename, 'w') as f:
-            f.writelines(self.code)
+        self.written(self.code, self.addressComments)
+        if self.output:
+            self.output.writelines(self.code)
+            self.output.close()
+            self.output = None
+        elif self.hack:
+            assembler = Assembler.Assembler(outFilename)
+            assembler.writelines(self.code)
+            assembler.close()
+        else:
+            with open(outFilename, 'w') as f:
+                f.writelines(self.code)
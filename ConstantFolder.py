@@ -0,0 +1,120 @@
+from Parser import Command, CommandType
+
+# binary operations on signed 16-bit values, as the generated code computes them
+FOLD = {
+    'add': lambda x, y: x + y,
+    'sub': lambda x, y: x - y,
+    'and': lambda x, y: x & y,
+    'or':  lambda x, y: x | y,
+    # eq, lt and gt compare by subtracting, so lt and gt see the wrapped difference
+    'eq':  lambda x, y: -1 if x == y else 0,
+    'lt':  lambda x, y: -1 if signed(x - y) < 0 else 0,
+    'gt':  lambda x, y: -1 if signed(x - y) > 0 else 0,
+}
+UNARY = {'neg': lambda x: -x, 'not': lambda x: ~x}
+
+# (operation, constant y) -> what x op y becomes: None to leave x alone, or an operation on x
+REDUCE = {
+    ('add', 0): None, ('sub', 0): None, ('or', 0): None, ('and', -1): None,
+    ('add', 1): 'inc', ('sub', -1): 'inc', ('add', -1): 'dec', ('sub', 1): 'dec',
+}
+
+def signed(value: int) -> int:
+    """Returns a value as a signed 16-bit word."""
+    return ((value + 32768) & 65535) - 32768
+
+class ConstantFolder:
+    """
+    Optimization pass over the Commands from Parser, before CodeWriter.
+    Constant expressions are evaluated with 16-bit wraparound, operations
+    that leave a value unchanged are removed, adding or subtracting 1
+    becomes the 'inc' or 'dec' command, and neg neg and not not cancel.
+    The commands are only looked at a few at a time, so it works with
+    streamed input.
+    """
+
+    def __init__(self) -> None:
+        self.removed = {'fold': 0, 'identity': 0, 'inc-dec': 0, 'double-negation': 0}
+
+    def optimize(self, commands):
+        """Yields the optimized Commands for an iterable of Commands."""
+        pending = []                # [value, Commands it replaces] of constants not yet written
+        held = None                 # neg or not not yet written, in case the next command cancels it
+        for cmd in commands:
+            t = cmd.type
+            if t is CommandType.C_COMMENT:
+                yield cmd
+                continue
+            if t is CommandType.C_PUSH and cmd.arg1 == 'constant' and cmd.index <= 32767:
+                if held:
+                    yield held
+                    held = None
+                pending.append([cmd.index, [cmd]])
+                continue
+            if t is CommandType.C_ARITHMETIC:
+                op = cmd.arg0
+                if op in UNARY:
+                    if pending:
+                        pending[-1][0] = signed(UNARY[op](pending[-1][0]))
+                        pending[-1][1].append(cmd)
+                    elif held and held.arg0 == op:
+                        held = None
+                        self.removed['double-negation'] += 2
+                    else:
+                        if held:
+                            yield held
+                        held = cmd
+                    continue
+                if op in FOLD and len(pending) >= 2:
+                    y, ySource = pending.pop()
+                    pending[-1][0] = signed(FOLD[op](pending[-1][0], y))
+                    pending[-1][1] += ySource + [cmd]
+                    continue
+                if len(pending) == 1 and (op, pending[0][0]) in REDUCE:
+                    y, ySource = pending.pop()
+                    reduced = REDUCE[(op, y)]
+                    if reduced is None:
+                        self.removed['identity'] += len(ySource) + 1
+                    else:
+                        self.removed['inc-dec'] += len(ySource)
+                        yield Command(CommandType.C_ARITHMETIC, reduced, ySource[0].line, reduced)
+                    continue
+            if held:
+                yield held
+                held = None
+            yield from self.constants(pending)
+            pending = []
+            yield cmd
+        if held:
+            yield held
+        yield from self.constants(pending)
+
+    def constants(self, pending: list):
+        """Yields the commands pushing each pending constant."""
+        for value, source in pending:
+            line = source[0].line
+            if 0 <= value:
+                commands = [Command(CommandType.C_PUSH, f'push constant {value}', line, 'push', 'constant', value)]
+            elif value == -32768:
+                commands = [Command(CommandType.C_PUSH, 'push constant 32767', line, 'push', 'constant', 32767),
+                            Command(CommandType.C_ARITHMETIC, 'not', line, 'not')]
+            else:
+                commands = [Command(CommandType.C_PUSH, f'push constant {-value}', line, 'push', 'constant', -value),
+                            Command(CommandType.C_ARITHMETIC, 'neg', line, 'neg')]
+            if len(commands) < len(source):
+                self.removed['fold'] += len(source) - len(commands)
+                yield from commands
+            else:
+                yield from source
+
+    def add(self, other: 'ConstantFolder') -> None:
+        """Adds the counts of another ConstantFolder, e.g. one used in a worker process."""
+        for name, n in other.removed.items():
+            self.removed[name] += n
+
+    def report(self) -> str:
+        """Returns the number of VM commands removed by each rule."""
+        lines = [f'Constant folding: {sum(self.removed.values())} VM commands eliminated']
+        for name, n in self.removed.items():
+            lines.append(f'  {name:<16} {n}')
+        return '\n'.join(lines)
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# Headless Hack CPU emulator, for running and timing the translator's output.
+
+import Assembler
+import argparse
+import json
+import sys
+
+# comp field, as decoded by Assembler.decode() -> (Python expression of a, d and m, True if the result can overflow 16 bits)
+COMP = {
+    '0':   ('0', False),      '1':   ('1', False),      '-1':  ('-1', False),
+    'D':   ('d', False),      'A':   ('a', False),      'M':   ('m', False),
+    '!D':  ('~d', False),     '!A':  ('~a', False),     '!M':  ('~m', False),
+    '-D':  ('-d', True),      '-A':  ('-a', True),      '-M':  ('-m', True),
+    'D+1': ('d + 1', True),   'A+1': ('a + 1', True),   'M+1': ('m + 1', True),
+    'D-1': ('d - 1', True),   'A-1': ('a - 1', True),   'M-1': ('m - 1', True),
+    'D+A': ('d + a', True),   'D+M': ('d + m', True),
+    'D-A': ('d - a', True),   'D-M': ('d - m', True),   'A-D': ('a - d', True),   'M-D': ('m - d', True),
+    'D&A': ('d & a', False),  'D&M': ('d & m', False),
+    'D|A': ('d | a', False),  'D|M': ('d | m', False),
+}
+
+# jump field -> condition on the computed value v
+JUMPS = {'JGT': 'v > 0', 'JEQ': 'v == 0', 'JGE': 'v >= 0', 'JLT': 'v < 0',
+         'JNE': 'v != 0', 'JLE': 'v <= 0', 'JMP': 'True'}
+
+RAM_SIZE = 32768
+
+def signed(value: int) -> int:
+    """Returns a value as a signed 16-bit word."""
+    return ((value + 32768) & 65535) - 32768
+
+class Emulator:
+    """
+    Headless Hack CPU, counting one cycle per instruction. The program
+    is assembled and decoded once, then each straight-line run of instructions
+    up to a jump is compiled to a Python function the first time it is
+    reached, so it executes as a unit rather than one instruction at a
+    time. Execution stops at the __FINIS__ loop written by CodeWriter,
+    at any other jump to itself, or when the cycle limit is reached.
+    """
+
+    def __init__(self, lines: list, ram: dict = None, machineCode: bool = False) -> None:
+        """
+        Loads a program, given as a list of lines of assembly code, or of
+        machine code from a .hack file if machineCode is true. ram gives
+        initial RAM contents as {address: value}.
+        """
+        if machineCode:
+            words = [int(line, 2) for line in lines if line.strip()]
+            self.symbols = {}
+        else:
+            assembler = Assembler.Assembler()
+            assembler.writelines(lines)
+            words = assembler.finish()
+            self.symbols = assembler.symbols
+        # decoded instructions: int for @value, (dest, comp, jump) otherwise
+        self.rom = [Assembler.decode(word) for word in words]
+        self.ram = [0] * RAM_SIZE
+        for address, value in (ram or {}).items():
+            self.ram[address] = signed(value)
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.blocks = {}            # start address -> (compiled function, instruction count)
+        self.finis = self.symbols.get('__FINIS__')
+
+    def run(self, maxCycles: int = 10_000_000, trace = None) -> bool:
+        """
+        Runs until the program halts or a total of maxCycles instructions
+        have been executed. Returns True if the program halted. If trace
+        is given, it is called after each block of instructions with the
+        block's start address, its length and the next address.
+        """
+        ram = self.ram
+        blocks = self.blocks
+        a, d, pc, cycles = self.a, self.d, self.pc, self.cycles
+        while True:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self.compile(pc)
+            function, n = block
+            if function is None:
+                self.halted = True
+                break
+            if cycles + n > maxCycles:
+                if cycles >= maxCycles:
+                    break
+                function, n = self.compile(pc, maxCycles - cycles)
+            start = pc
+            a, d, pc = function(ram, a, d)
+            cycles += n
+            if trace:
+                trace(start, n, pc)
+        self.a, self.d, self.pc, self.cycles = a, d, pc, cycles
+        return self.halted
+
+    def compile(self, start: int, limit: int = None) -> tuple:
+        """
+        Compiles the instructions from start up to and including the
+        next jump, or at most limit instructions. Returns the function,
+        which takes (ram, a, d) and returns (a, d, next pc), and the
+        number of instructions, or (None, 0) if the program halts here.
+        """
+        rom = self.rom
+        if start >= len(rom) or start == self.finis or self.isLoop(start):
+            return None, 0
+        end = len(rom) if limit is None else min(len(rom), start + limit)
+        body = []
+        known = None                # value of A, when set by an A-instruction in this block
+        pc = start
+        while pc < end:
+            inst = rom[pc]
+            pc += 1
+            if isinstance(inst, int):
+                body.append(f'a = {inst}')
+                known = inst
+                continue
+            dest, comp, jump = inst
+            address = str(known) if known is not None else '(a & 32767)'
+            expr, overflows = COMP[comp]
+            expr = expr.replace('m', f'ram[{address}]')
+            if overflows:
+                expr = f'(({expr}) + 32768 & 65535) - 32768'
+            target = str(known) if known is not None else '(a & 32767)'
+            if len(dest) == 1 and not jump:
+                # the common case needs no temporary
+                register = {'A': 'a', 'D': 'd', 'M': f'ram[{address}]'}[dest]
+                body.append(f'{register} = {expr}')
+            else:
+                body.append(f'v = {expr}')
+                if jump and 'A' in dest and known is None:
+                    body.append('t = a')
+                    target = '(t & 32767)'
+                if 'M' in dest:
+                    body.append(f'ram[{address}] = v')
+                if 'D' in dest:
+                    body.append('d = v')
+                if 'A' in dest:
+                    body.append('a = v')
+            if 'A' in dest:
+                known = None
+            if jump:
+                if jump == 'JMP':
+                    body.append(f'return a, d, {target}')
+                else:
+                    body.append(f'if {JUMPS[jump]}: return a, d, {target}')
+                    body.append(f'return a, d, {pc}')
+                break
+        else:
+            body.append(f'return a, d, {pc}')
+        source = 'def block(ram, a, d):\n' + ''.join(f'    {line}\n' for line in body)
+        namespace = {}
+        exec(compile(source, f'<ROM {start}>', 'exec'), namespace)
+        return namespace['block'], pc - start
+
+    def isLoop(self, address: int) -> bool:
+        """True if the instructions at address are an unconditional jump to itself."""
+        rom = self.rom
+        return (address + 1 < len(rom) and rom[address] == address
+                and not isinstance(rom[address + 1], int)
+                and rom[address + 1][0] == '' and rom[address + 1][2] == 'JMP')
+
+    def report(self, ranges: list = None) -> dict:
+        """
+        Returns the cycle count and the final RAM state: the registers
+        RAM[0..15], the stack from 256 up to SP, and any other
+        (start, end) address ranges asked for.
+        """
+        ram = self.ram
+        sp = ram[0] if 256 <= ram[0] <= 2047 else 256
+        result = {
+            'halted': self.halted,
+            'cycles': self.cycles,
+            'words': len(self.rom),
+            'registers': ram[0:16],
+            'stack': ram[256:sp],
+        }
+        for start, end in ranges or []:
+            result[f'{start}-{end}'] = ram[start:end + 1]
+        return result
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(
+        description='A headless Hack CPU emulator. Runs a program until it halts and reports cycles and RAM.')
+    argParser.add_argument('source', help='Input .asm or .hack file')
+    argParser.add_argument('--cycles', type=int, default=10_000_000,
+        help='Stop after this many cycles (default 10000000)')
+    argParser.add_argument('--ram', action='append', default=[], metavar='ADDR=VALUE',
+        help='Set a RAM location before running, e.g. --ram 0=256 (may be repeated)')
+    argParser.add_argument('--dump', action='append', default=[], metavar='START-END',
+        help='Also report this range of RAM addresses (may be repeated)')
+    argParser.add_argument('--json', action='store_true',
+        help='Write the report as JSON')
+    args = argParser.parse_args()
+
+    try:
+        ram = {int(k): int(v) for k, v in (item.split('=') for item in args.ram)}
+        ranges = [tuple(int(n) for n in item.split('-')) for item in args.dump]
+    except ValueError:
+        print('Error: --ram takes ADDR=VALUE and --dump takes START-END', file=sys.stderr)
+        sys.exit(1)
+    try:
+        with open(args.source) as f:
+            emulator = Emulator(f.readlines(), ram, args.source.endswith('.hack'))
+    except (OSError, ValueError) as e:
+        print(f'Error: {str(e)}', file=sys.stderr)
+        sys.exit(2)
+
+    emulator.run(args.cycles)
+    result = emulator.report(ranges)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        if result['halted']:
+            print(f'Halted after {result["cycles"]} cycles, {result["words"]} words of ROM')
+        else:
+            print(f'Cycle limit reached after {result["cycles"]} cycles, {result["words"]} words of ROM')
+        for name, values in result.items():
+            if isinstance(values, list):
+                print(f'{name}: {" ".join(str(v) for v in values)}')
+    if not result['halted']:
+        sys.exit(3)
+
+if __name__ == '__main__':
+    main()
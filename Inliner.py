@@ -0,0 +1,188 @@
+from Parser import Command, CommandType
+
+# change in stack depth made by each arithmetic command
+ARITHMETIC_EFFECT = {'add': -1, 'sub': -1, 'and': -1, 'or': -1, 'eq': -1, 'lt': -1, 'gt': -1,
+                     'neg': 0, 'not': 0}
+
+class Function:
+    """A function that can be inlined: its body and the stack depth before each command."""
+
+    def __init__(self, name: str, nVars: int) -> None:
+        self.name = name
+        self.nVars = nVars
+        self.body = []              # (Command, number of values on the stack above the locals)
+        self.nArgs = 0              # arguments used: 1 + the highest argument index
+        self.saved = []             # pointer indices the body pops to, which the caller must get back
+        self.returns = 0
+
+    def __repr__(self) -> str:
+        # part of the build cache key, so it must not depend on object addresses
+        return f'Function({self.name!r}, {self.nVars}, {[cmd.text for cmd, depth in self.body]!r})'
+
+class Inliner:
+    """
+    Optimization pass over the Commands from Parser, before CodeWriter.
+    Calls to small leaf functions without loops are replaced by the
+    function body. A loop would take most of the time anyway, and
+    the variables in the frame cost more to reach than through LCL and
+    ARG.
+    The arguments are already on the stack at the call site, and the
+    locals are pushed after them, so no frame is built: because a leaf
+    function calls nothing, the stack depth is known at each command of
+    its body, and argument and local are remapped to the 'frame'
+    segment, addressed from SP. Labels are renamed for each call site.
+    THIS and THAT are saved if the body changes them, as the call
+    would have restored them. Functions using static variables are not
+    inlined, as the static segment belongs to the file of the function.
+    """
+
+    def __init__(self, maxCommands: int = 0, functions: dict = None) -> None:
+        """
+        Functions of up to maxCommands VM commands are inlined, found with
+        addFile(), or functions gives them from an Inliner that has
+        already looked at all the files.
+        """
+        self.maxCommands = maxCommands
+        self.functions = functions if functions is not None else {}
+        self.function = ''          # function being optimized and its inline expansions, for label names
+        self.sites = 0
+        self.removed = {'inlined-calls': 0}
+
+    def addFile(self, commands) -> None:
+        """Finds the functions in a file's Commands that can be inlined."""
+        function = None
+        body = []
+        for cmd in commands:
+            if cmd.type is CommandType.C_FUNCTION:
+                self.addFunction(function, body)
+                function = cmd
+                body = []
+            elif cmd.type is not CommandType.C_COMMENT:
+                body.append(cmd)
+        self.addFunction(function, body)
+
+    def addFunction(self, function: Command, body: list) -> None:
+        if function:
+            f = self.analyze(function, body)
+            if f:
+                self.functions[f.name] = f
+
+    def analyze(self, function: Command, body: list) -> Function:
+        """Returns the Function if it can be inlined, otherwise None."""
+        if len(body) > self.maxCommands or not body or body[-1].type is not CommandType.C_RETURN:
+            return None
+        f = Function(function.arg1, function.index)
+        depth = 0                   # None after goto or return, until a label
+        labels = {}                 # label -> stack depth on jumping to it
+        for cmd in body:
+            t = cmd.type
+            if t is CommandType.C_LABEL:
+                if depth is None:
+                    depth = labels.get(cmd.arg1)
+                    if depth is None:
+                        return None     # only reached by a backward jump, depth unknown
+                elif labels.setdefault(cmd.arg1, depth) != depth:
+                    return None
+            elif depth is None:
+                return None         # unreachable code, leave the function alone
+            f.body.append((cmd, depth))
+            if t is CommandType.C_LABEL:
+                continue
+            if t is CommandType.C_PUSH or t is CommandType.C_POP:
+                if cmd.arg1 == 'static':
+                    return None
+                if cmd.arg1 == 'argument':
+                    f.nArgs = max(f.nArgs, cmd.index + 1)
+                elif cmd.arg1 == 'local' and cmd.index >= f.nVars:
+                    return None
+                elif t is CommandType.C_POP and cmd.arg1 == 'pointer' and cmd.index not in f.saved:
+                    f.saved.append(cmd.index)
+                depth += 1 if t is CommandType.C_PUSH else -1
+            elif t is CommandType.C_ARITHMETIC:
+                depth += ARITHMETIC_EFFECT[cmd.arg0]
+            elif t is CommandType.C_GOTO or t is CommandType.C_IF:
+                if t is CommandType.C_IF:
+                    depth -= 1
+                if any(cmd.arg1 == c.arg1 for c, d in f.body if c.type is CommandType.C_LABEL):
+                    return None     # a loop
+                if labels.setdefault(cmd.arg1, depth) != depth:
+                    return None
+                if t is CommandType.C_GOTO:
+                    depth = None
+            elif t is CommandType.C_RETURN:
+                if depth < 1:
+                    return None
+                f.returns += 1
+                depth = None
+            else:
+                return None         # a call: not a leaf function
+            if depth is not None and depth < 0:
+                return None
+        if any(label not in {cmd.arg1 for cmd, d in f.body if cmd.type is CommandType.C_LABEL}
+               for label in labels):
+            return None
+        return f
+
+    def optimize(self, commands):
+        """Yields the optimized Commands for an iterable of Commands."""
+        for cmd in commands:
+            if cmd.type is CommandType.C_FUNCTION:
+                self.function = cmd.arg1
+                self.sites = 0
+            elif cmd.type is CommandType.C_CALL:
+                f = self.functions.get(cmd.arg1)
+                if f and f.nArgs <= cmd.index:
+                    self.removed['inlined-calls'] += 1
+                    yield from self.expand(f, cmd)
+                    continue
+            yield cmd
+
+    def expand(self, f: Function, call: Command):
+        """Yields the Commands replacing a call to f."""
+        self.sites += 1
+        prefix = f'{self.function}$inline{self.sites}'
+        end = prefix + '$end'
+        line = call.line
+        nArgs = call.index
+        saved = len(f.saved)
+        yield Command(CommandType.C_CALL, call.text, line, 'inline', f.name, nArgs)
+        for i in range(f.nVars):
+            yield Command(CommandType.C_PUSH, '*inline local', line, 'push', 'constant', 0)
+        for p in f.saved:
+            yield Command(CommandType.C_PUSH, '*save pointer', line, 'push', 'pointer', p)
+        returns = 0
+        for cmd, depth in f.body:
+            t = cmd.type
+            # values on the stack from the first argument up
+            frame = nArgs + f.nVars + saved + depth
+            if (t is CommandType.C_PUSH or t is CommandType.C_POP) and cmd.arg1 in ('argument', 'local'):
+                offset = cmd.index if cmd.arg1 == 'argument' else nArgs + cmd.index
+                yield Command(t, cmd.text, cmd.line, cmd.arg0, 'frame', frame - offset)
+            elif t is CommandType.C_LABEL or t is CommandType.C_GOTO or t is CommandType.C_IF:
+                yield Command(t, cmd.text, cmd.line, cmd.arg0, f'{prefix}.{cmd.arg1}')
+            elif t is CommandType.C_RETURN:
+                returns += 1
+                for i, p in enumerate(f.saved):
+                    # the saved pointers are just above the locals
+                    offset = nArgs + f.nVars + i
+                    yield Command(CommandType.C_PUSH, '*restore pointer', cmd.line, 'push', 'frame', frame - offset)
+                    yield Command(CommandType.C_POP, '*restore pointer', cmd.line, 'pop', 'pointer', p)
+                last = returns == f.returns
+                yield Command(CommandType.C_RETURN, cmd.text, cmd.line, 'inline', 'last' if last else '', frame)
+                if not last:
+                    yield Command(CommandType.C_GOTO, f'goto {end}', cmd.line, 'goto', end)
+            else:
+                yield cmd
+        if f.returns > 1:
+            yield Command(CommandType.C_LABEL, f'label {end}', line, 'label', end)
+
+    def add(self, other: 'Inliner') -> None:
+        """Adds the counts of another Inliner, e.g. one used in a worker process."""
+        for name, n in other.removed.items():
+            self.removed[name] += n
+
+    def report(self) -> str:
+        """Returns the functions that can be inlined and the number of calls inlined."""
+        return (f'Inlining: {len(self.functions)} functions can be inlined '
+                f'({", ".join(sorted(self.functions)) or "none"}), '
+                f'{self.removed["inlined-calls"]} calls inlined')
@@ -1,5 +1,42 @@
 import os
 import sys
+from enum import Enum
+
+class CommandType(Enum):
+    """The types of VM command, as returned by Parser.commandType()."""
+    C_COMMENT = 0       # comment or blank line
+    C_ARITHMETIC = 1
+    C_PUSH = 2
+    C_POP = 3
+    C_LABEL = 4
+    C_GOTO = 5
+    C_IF = 6
+    C_FUNCTION = 7
+    C_RETURN = 8
+    C_CALL = 9
+    C_ERROR = 10
+
+class Command:
+    """
+    A single parsed line of VM code. arg0 is the command name; arg1 is
+    the segment, label or function name; index is the segment index,
+    nVars or nArgs as an int. For C_ERROR, arg1 is the error message.
+    text is the line as read, without the trailing newline, and line
+    is its line number in the file.
+    """
+    __slots__ = ('type', 'arg0', 'arg1', 'index', 'text', 'line')
+
+    def __init__(self, type: CommandType, text: str, line: int,
+                 arg0: str = '', arg1: str = '', index: int = 0) -> None:
+        self.type = type
+        self.arg0 = arg0
+        self.arg1 = arg1
+        self.index = index
+        self.text = text
+        self.line = line
+
+    def __repr__(self) -> str:
+        return f'Command({self.type.name}, {self.text!r}, line {self.line})'
 
 class Parser:
     """
@@ -8,10 +45,16 @@ class Parser:
     space (blank lines) and comments.
     """
 
-    def __init__(self, infile: str) -> None:
+    def __init__(self, infile: str, stream: bool = False, lines = None, quiet: bool = False) -> None:
         """
         Process command line arguments, process the input filename,
         open and read it, construct the output filename.
+        If stream is true, the file is not read into memory; commands()
+        reads it a line at a time instead.
+        If lines is given, an iterable of lines of VM code, the file is
+        not read at all, infile only names it.
+        If quiet is true, invalid lines are not reported, only returned
+        as C_ERROR Commands.
         """
 
         # initialize instance variables
@@ -19,17 +62,27 @@ class Parser:
         self.lines = []         # list of lines in the input file
         self.nLines = 0         # number of lines in the input file
         self.currentLine = 0    # the number of the current line being processed
-        self.arithmeticCommands = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
-        self.memorySegments = ['argument', 'local', 'static', 'constant', 'this', 'that', 'pointer', 'temp']
+        self.command = None     # the current command as a Command
+        self.arithmeticCommands = frozenset(['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not'])
+        self.memorySegments = frozenset(['argument', 'local', 'static', 'constant', 'this', 'that', 'pointer', 'temp'])
+        self.labelCommands = {'label': CommandType.C_LABEL, 'goto': CommandType.C_GOTO, 'if-goto': CommandType.C_IF}
         self.filename = ''      # just the input filename (no dir, no ext) for CodeWriter static variables
 
+        self.infile = infile
+        self.stream = stream and lines is None
+        self.quiet = quiet
+
         # read the input file into a list
-        try:
-            with open(infile, 'r') as f:
-                self.lines = f.readlines()
-        except Exception as e:
-            print(f'Error reading {infile}: {str(e)}', file=sys.stderr)
-            sys.exit(4)
+        if lines is not None:
+            self.lines = lines if isinstance(lines, list) else list(lines)
+        else:
+            try:
+                with open(infile, 'r') as f:
+                    if not stream:
+                        self.lines = f.readlines()
+            except Exception as e:
+                print(f'Error reading {infile}: {str(e)}', file=sys.stderr)
+                sys.exit(4)
         self.nLines = len(self.lines)
 
         # get just the filename without directory or extension
@@ -40,6 +93,58 @@ class Parser:
         #print('Parser destructed.', file=sys.stderr)
         pass
 
+    def commands(self):
+        """Parses each line of the input once and yields it as a Command."""
+        parse = self.parse
+        if self.stream:
+            with open(self.infile, 'r') as f:
+                for n, line in enumerate(f, 1):
+                    yield parse(line.rstrip(), n)
+        else:
+            for n, line in enumerate(self.lines, 1):
+                yield parse(line.rstrip(), n)
+
+    def parse(self, text: str, lineNumber: int) -> Command:
+        """
+        Splits a line of VM code into its fields and returns it as a
+        Command. Invalid lines are reported and returned as C_ERROR.
+        """
+        # remove any trailing comment
+        comment = text.find('//')
+        parts = (text if comment < 0 else text[:comment]).split()
+        n = len(parts)
+        if n == 0:
+            return Command(CommandType.C_COMMENT, text, lineNumber)
+        name = parts[0]
+        if n == 1:
+            if name in self.arithmeticCommands:
+                return Command(CommandType.C_ARITHMETIC, text, lineNumber, name)
+            if name == 'return':
+                return Command(CommandType.C_RETURN, text, lineNumber, name)
+        elif n == 2:
+            if name in self.labelCommands:
+                return Command(self.labelCommands[name], text, lineNumber, name, parts[1])
+        elif n == 3:
+            # error checking for push and pop
+            if name == 'push' or name == 'pop':
+                if not parts[2].isnumeric():
+                    return self.error('Index not numeric', text, lineNumber)
+                if parts[1] not in self.memorySegments:
+                    return self.error('Invalid memory segment', text, lineNumber)
+                cmdType = CommandType.C_PUSH if name == 'push' else CommandType.C_POP
+                return Command(cmdType, text, lineNumber, name, parts[1], int(parts[2]))
+            if (name == 'function' or name == 'call') and parts[2].isnumeric():
+                cmdType = CommandType.C_FUNCTION if name == 'function' else CommandType.C_CALL
+                return Command(cmdType, text, lineNumber, name, parts[1], int(parts[2]))
+        return self.error('Invalid command', text, lineNumber)
+
+    def error(self, message: str, text: str, lineNumber: int) -> Command:
+        """Reports an invalid line and returns it as a C_ERROR Command."""
+        message = f'{message} on line {lineNumber}:\n{text}'
+        if not self.quiet:
+            print(message)
+        return Command(CommandType.C_ERROR, text, lineNumber, '', message)
+
     def hasMoreLines(self) -> bool:
         """Are there more commands in the input?"""
         return self.currentLine < self.nLines
@@ -52,71 +157,29 @@ class Parser:
         """
         self.currentCmd = self.lines[self.currentLine].rstrip()
         self.currentLine += 1
+        self.command = self.parse(self.currentCmd, self.currentLine)
 
     def commandType(self) -> str:
         """Returns the type of the current command."""
-        # remove any trailing comment
-        cmd = self.currentCmd.split('//')[0].strip()
-        if len(cmd) == 0:
-            return 'C_COMMENT'
-        else:
-            self.cmdParts = cmd.split()
-            if len(self.cmdParts) == 1:
-                if self.cmdParts[0] in self.arithmeticCommands:
-                    return 'C_ARITHMETIC'
-                if self.cmdParts[0] == 'return':
-                    return 'C_RETURN'
-                else:
-                    print(f'Invalid command on line {self.currentLine}:\n{self.currentCmd}')
-                    return 'C_ERROR'
-            elif len(self.cmdParts) == 2:
-                if self.cmdParts[0] == 'label':
-                    return 'C_LABEL'
-                elif self.cmdParts[0] == 'goto':
-                    return 'C_GOTO'
-                elif self.cmdParts[0] == 'if-goto':
-                    return 'C_IF'
-                else:
-                    print(f'Invalid command on line {self.currentLine}:\n{self.currentCmd}')
-                    return 'C_ERROR'
-            elif len(self.cmdParts) == 3:
-                # error checking for push and pop
-                if self.cmdParts[0] == 'push' or self.cmdParts[0] == 'pop':
-                    if not self.cmdParts[2].isnumeric():
-                        print(f'Index not numeric on line {self.currentLine}:\n{self.currentCmd}')
-                        return 'C_ERROR'
-                    if self.cmdParts[1] not in self.memorySegments:
-                        print(f'Invalid memory segment on line {self.currentLine}:\n{self.currentCmd}')
-                        return 'C_ERROR'
-                if self.cmdParts[0] == 'push':
-                    return 'C_PUSH'
-                elif self.cmdParts[0] == 'pop':
-                    return 'C_POP'
-                elif self.cmdParts[0] == 'function':
-                    return 'C_FUNCTION'
-                elif self.cmdParts[0] == 'call':
-                    return 'C_CALL'
-                else:
-                    print(f'Invalid command on line {self.currentLine}:\n{self.currentCmd}')
-                    return 'C_ERROR'
+        return self.command.type.name
 
     def arg0(self) -> str:
         """
         Returns the first field from the current command, which is
         the name of the command.
         """
-        return self.cmdParts[0]
+        return self.command.arg0
 
     def arg1(self) -> str:
         """
         Returns the second field from the current command, which is
         the segment name. Should be called for push/pop commands only.
         """
-        return self.cmdParts[1]
+        return self.command.arg1
 
     def arg2(self) -> str:
         """
         Returns the third field from the current command, which is
         the segment index. Should be called for push/pop commands only.
         """
-        return self.cmdParts[2]
+        return str(self.command.index)
@@ -0,0 +1,256 @@
+class Instruction:
+    """
+    One Hack instruction in the stream being optimized. Objects, rather
+    than addresses, are used to track jump targets so that they stay
+    correct while instructions are removed.
+    """
+    __slots__ = ('text', 'target', 'ref', 'alias', 'address')
+
+    def __init__(self, text: str) -> None:
+        self.text = text        # instruction without indent or newline
+        self.target = False     # True if a jump may land on this instruction
+        self.ref = None         # for absolute addresses: the Instruction jumped to
+        self.alias = None       # set when this instruction is removed: where its jumps now land
+        self.address = 0
+
+    def resolve(self) -> 'Instruction':
+        """Follows aliases left by removed instructions."""
+        inst = self
+        while inst.alias:
+            inst = inst.alias
+        return inst
+
+class AddressComment:
+    """A '// [address] command' comment, renumbered when instructions before it are removed."""
+    __slots__ = ('rest',)
+
+    def __init__(self, line: str) -> None:
+        self.rest = line[line.index(']', 4):]      # the comment from the ']' on
+
+def isAInstruction(text: str) -> bool:
+    return text[0] == '@'
+
+def dest(text: str) -> str:
+    """Returns the destination part of a C-instruction, '' if none."""
+    eq = text.find('=')
+    return text[:eq] if eq >= 0 else ''
+
+def hasJump(text: str) -> bool:
+    return ';' in text
+
+# Each rule is given a window of instruction texts and returns the
+# replacement list, or None if it does not apply.
+
+def pushPop(w: list) -> list:
+    """
+    Push D immediately followed by pop to D, once the SP increment and
+    decrement have been merged: D is unchanged, and the stored word is
+    above SP afterwards so it is dead. A is left where the pop leaves it.
+    """
+    if w == ['@SP', 'A=M', 'M=D', '@SP', 'A=M', 'D=M']:
+        return ['@SP', 'A=M']
+
+def incrementDecrement(w: list) -> list:
+    """M=M+1; AM=M-1 leaves M unchanged and loads it into A."""
+    if w == ['M=M+1', 'AM=M-1']:
+        return ['A=M']
+
+def decrementA(w: list) -> list:
+    """A=M; A=A-1 becomes A=M-1."""
+    if w == ['A=M', 'A=A-1']:
+        return ['A=M-1']
+
+def deadA(w: list) -> list:
+    """A value only loaded into A is dead if the next instruction loads A."""
+    if isAInstruction(w[1]) and (isAInstruction(w[0]) or (dest(w[0]) == 'A' and not hasJump(w[0]))):
+        return [w[1]]
+
+def reloadA(w: list) -> list:
+    """@X; c; @X where c does not change A: the second @X is redundant."""
+    if w[0] == w[2] and isAInstruction(w[0]) and not isAInstruction(w[1]) \
+            and 'A' not in dest(w[1]) and not hasJump(w[1]):
+        return w[:2]
+
+def storeLoad(w: list) -> list:
+    """M=D; D=M: D already holds the value just stored."""
+    if w == ['M=D', 'D=M']:
+        return ['M=D']
+
+# (name, window width, function, prefix of the last instruction in the window)
+RULES = [
+    ('inc-dec',     2, incrementDecrement, 'AM=M-1'),
+    ('push-pop',    6, pushPop,            'D=M'),
+    ('decrement-a', 2, decrementA,         'A=A-1'),
+    ('dead-a',      2, deadA,              '@'),
+    ('reload-a',    3, reloadA,            '@'),
+    ('store-load',  2, storeLoad,          'D=M'),
+]
+
+class Peephole:
+    """
+    Peephole optimizer over the Hack instruction stream produced by
+    CodeWriter. Rules are matched against the most recently kept
+    instructions as each instruction is added, so a replacement can
+    enable further matches with the instructions before it. A window
+    never extends past a label or a jump target, except that it may
+    start with one.
+    """
+
+    def __init__(self, rules: list = None) -> None:
+        """Uses the default rule table unless one is given."""
+        self.rules = []             # (name, window width, function, prefix)
+        self.removed = {}           # rule name -> instructions removed
+        self.triggers = {}          # first character of the last instruction -> rules to try
+        self.anyTrigger = []        # rules with no prefix, tried after every instruction
+        for entry in (RULES if rules is None else rules):
+            self.addRule(*entry)
+
+    def addRule(self, name: str, width: int, rule, prefix: str = '') -> None:
+        """
+        Adds a rule. rule is called with a list of width instruction
+        texts and returns the replacement list, or None. It is only
+        tried when the last instruction in the window starts with prefix.
+        """
+        entry = (name, width, rule, prefix)
+        self.rules.append(entry)
+        self.removed.setdefault(name, 0)
+        if prefix:
+            self.triggers.setdefault(prefix[0], list(self.anyTrigger)).append(entry)
+        else:
+            self.anyTrigger.append(entry)
+            for rules in self.triggers.values():
+                rules.append(entry)
+
+    def optimize(self, code: list, relocs: dict, addressComments: list = (), base: int = 0) -> tuple:
+        """
+        Optimizes a list of output lines as built by CodeWriter. relocs
+        maps the index of each A-instruction holding an absolute ROM
+        address to that address, counted from the start of code, and
+        addressComments gives the indices of the '// [address]' comments,
+        whose addresses are updated. Other comments are left as they are.
+        The optimized code is placed at address base. Returns the new
+        list of lines, the new relocs, the new indices of the address
+        comments and the number of instruction words.
+        """
+        # pass 1: make Instruction objects and mark the jump targets
+        items = []                  # Instruction objects and other lines (comments, labels)
+        insts = []                  # Instruction objects by original address
+        label = False
+        comments = set(addressComments)
+        for i, line in enumerate(code):
+            # instructions are indented by two spaces, VM comments passed through may be indented too
+            if line.startswith('  ') and line[2:3] not in ' \t\n/':
+                inst = Instruction(line.strip())
+                inst.target = label
+                label = False
+                items.append(inst)
+                insts.append(inst)
+            elif i in comments:
+                items.append(AddressComment(line))
+            else:
+                if line.startswith('('):
+                    label = True
+                items.append(line)
+        end = Instruction('')       # stands for the address after the last instruction
+        end.target = True
+        insts.append(end)
+        for index, address in relocs.items():
+            inst = items[index]
+            inst.ref = insts[address]
+            inst.ref.target = True
+
+        # pass 2: add the instructions one at a time, trying the rules on the tail
+        out = []                    # kept lines
+        tail = []                   # indices in out of the kept Instructions
+        orphans = []                # removed jump targets waiting for the next instruction
+        triggers = self.triggers
+        anyTrigger = self.anyTrigger
+        for item in items:
+            if not isinstance(item, Instruction):
+                out.append(item)
+                continue
+            if orphans:
+                for orphan in orphans:
+                    orphan.alias = item
+                item.target = True
+                orphans = []
+            tail.append(len(out))
+            out.append(item)
+            matched = True
+            while matched:
+                matched = False
+                last = out[tail[-1]].text if tail else ''
+                for name, width, rule, prefix in triggers.get(last[:1], anyTrigger):
+                    if width > len(tail) or not last.startswith(prefix):
+                        continue
+                    window = [out[i] for i in tail[-width:]]
+                    texts = [inst.text for inst in window]
+                    replacement = rule(texts)
+                    if replacement is None or replacement == texts:
+                        continue
+                    if any(inst.ref for inst in window) or any(inst.target for inst in window[1:]):
+                        continue
+                    self.removed[name] += width - len(replacement)
+                    orphans += self.replace(out, tail, width, replacement)
+                    matched = True
+                    break
+        for orphan in orphans:
+            orphan.alias = end
+
+        # pass 3: assign addresses and write the lines
+        address = base
+        for item in out:
+            if isinstance(item, Instruction):
+                item.address = address
+                address += 1
+        end.address = address
+        lines = []
+        newRelocs = {}
+        newComments = []
+        address = base
+        for item in out:
+            if isinstance(item, Instruction):
+                if item.ref:
+                    target = item.ref.resolve().address
+                    newRelocs[len(lines)] = target
+                    lines.append(f'  @{target}\n')
+                else:
+                    lines.append('  ' + item.text + '\n')
+                address += 1
+            elif isinstance(item, AddressComment):
+                newComments.append(len(lines))
+                lines.append(f'// [{address}{item.rest}')
+            else:
+                lines.append(item)
+        return lines, newRelocs, newComments, address - base
+
+    def replace(self, out: list, tail: list, width: int, replacement: list) -> list:
+        """
+        Replaces the last width instructions in out, keeping the comments
+        between them in order. Returns the removed instruction if it was
+        a jump target, so the jump can be moved to the next instruction.
+        """
+        first = tail[-width]
+        window = out[first:]
+        del out[first:]
+        del tail[-width:]
+        n = 0
+        for item in window:
+            if isinstance(item, Instruction):
+                if n < len(replacement):
+                    item.text = replacement[n]
+                    tail.append(len(out))
+                    out.append(item)
+                n += 1
+            else:
+                out.append(item)
+        if not replacement and window[0].target:
+            return [window[0]]
+        return []
+
+    def report(self) -> str:
+        """Returns the number of instructions removed by each rule."""
+        lines = [f'Peephole: {sum(self.removed.values())} instructions removed']
+        for name, width, rule, prefix in self.rules:
+            lines.append(f'  {name:<12} {self.removed[name]}')
+        return '\n'.join(lines)
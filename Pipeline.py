@@ -0,0 +1,95 @@
+# The parts of a translation shared by vmt.py and the Translator API:
+# the optimization passes, writing the Commands and the errors raised.
+
+import BranchFuser
+import CodeWriter
+import ConstantFolder
+import Inliner
+from Parser import CommandType
+import TailCaller
+
+class TranslationError(Exception):
+    """
+    An error in the VM code being translated. filename is the name
+    of the source without .vm, line and text the line at fault, if any.
+    """
+
+    def __init__(self, message: str, filename: str = '', line: int = 0, text: str = '') -> None:
+        super().__init__(message)
+        self.message = message
+        self.filename = filename
+        self.line = line
+        self.text = text
+
+    def __str__(self) -> str:
+        where = f'{self.filename}.vm' if self.filename else ''
+        if self.line:
+            where += f':{self.line}'
+        return (f'{where}: ' if where else '') + self.message + (f': {self.text.strip()}' if self.text else '')
+
+class SourceError(TranslationError):
+    """A line of VM code that is not a valid command."""
+
+def makePasses(passOptions: dict) -> list:
+    """Returns the optimization passes to run over the Commands of each file, in order."""
+    passes = []
+    if 'inline' in passOptions:
+        # first, so the other passes also see the inlined code
+        passes.append(Inliner.Inliner(functions=passOptions['inline']))
+    if passOptions.get('fold'):
+        passes.append(ConstantFolder.ConstantFolder())
+    if passOptions.get('fuse'):
+        passes.append(BranchFuser.BranchFuser())
+    if passOptions.get('tail'):
+        passes.append(TailCaller.TailCaller())
+    return passes
+
+def writeCommands(writer: CodeWriter.CodeWriter, commands, reachable: set = None,
+                  dropped: CodeWriter.CodeWriter = None,
+                  w: CodeWriter.CodeWriter = None) -> CodeWriter.CodeWriter:
+    """
+    Writes Commands of the file being translated, to the writer, or to
+    the dropped writer in functions not in reachable. w is the writer
+    the previous Commands of the file went to. Returns the one the next
+    Commands go to, so a file can be written a part at a time. Raises
+    SourceError at an invalid line.
+    """
+    w = w or writer
+    for cmd in commands:
+        t = cmd.type
+        w.line = cmd.line
+        if t is CommandType.C_PUSH or t is CommandType.C_POP:
+            w.writePushPop(cmd.text, cmd.arg0, cmd.arg1, cmd.index)
+        elif t is CommandType.C_ARITHMETIC:
+            w.writeArithmetic(cmd.text, cmd.arg0)
+        elif t is CommandType.C_COMMENT:
+            w.writeComment(cmd.text)
+        elif t is CommandType.C_LABEL:
+            w.writeLabel(cmd.text, cmd.arg1)
+        elif t is CommandType.C_GOTO:
+            w.writeGoto(cmd.text, cmd.arg1)
+        elif t is CommandType.C_IF:
+            if cmd.arg0 == 'if-goto':
+                w.writeIf(cmd.text, cmd.arg1)
+            else:
+                w.writeCompareIf(cmd.text, cmd.arg1, cmd.arg0)      # from BranchFuser
+        elif t is CommandType.C_FUNCTION:
+            if reachable is not None:
+                w = writer if cmd.arg1 in reachable else dropped
+                w.line = cmd.line
+            w.writeFunction(cmd.text, cmd.arg1, cmd.index)
+        elif t is CommandType.C_RETURN:
+            if cmd.arg0 == 'return':
+                w.writeReturn(cmd.text)
+            else:
+                w.writeInlineReturn(cmd.text, cmd.index, cmd.arg1 == 'last')   # from Inliner
+        elif t is CommandType.C_CALL:
+            if cmd.arg0 == 'call':
+                w.writeCall(cmd.text, cmd.arg1, cmd.index)
+            elif cmd.arg0 == 'tail':
+                w.writeTailCall(cmd.text, cmd.arg1, cmd.index)              # from TailCaller
+            else:
+                w.writeInlineCall(cmd.text, cmd.arg1, cmd.index)            # from Inliner
+        else:
+            raise SourceError(cmd.arg1.partition(' on line ')[0], w.progname, cmd.line, cmd.text)
+    return w
@@ -0,0 +1,161 @@
+from Emulator import Emulator
+
+TOP_LEVEL = '(top level)'       # code outside any function: the bootstrap, or a program without one
+
+class Profiler:
+    """
+    Cycle profiler for translated programs. The '// [address] command'
+    comments in the assembly code, paired with the VM source lines that
+    CodeWriter records for them, map each instruction back to the VM
+    command it was generated from. The program is run in the Emulator,
+    and the cycles are counted per VM function, per VM source line and
+    per call path. Functions are entered by jumping to their label and
+    left by jumping to the return address saved in their frame, with
+    the caller's LCL restored.
+    """
+
+    def __init__(self, lines: list, sourceMap: list, commentLines: list, ram: dict = None) -> None:
+        """
+        lines is the assembly code written by CodeWriter, sourceMap its
+        sourceMap, holding (progname, line) for each address comment, and
+        commentLines its commentLines, the index in lines of each one.
+        """
+        self.emulator = Emulator(lines, ram)
+        self.starts = []            # address of each VM command, in order
+        self.commands = []          # [progname, line, text, function] of each VM command
+        self.entries = {}           # function entry address -> function name
+        self.mapSource(lines, sourceMap, commentLines)
+        self.blockCounts = {}       # (start address, length) -> times executed
+        self.pathCycles = {}        # call path -> cycles spent with it on top of the call stack
+        self.pathCalls = {}         # call path -> times entered
+        self.stack = []             # (return address, caller's LCL, caller's path) of each active call
+        self.path = (TOP_LEVEL,)
+
+    def mapSource(self, lines: list, sourceMap: list, commentLines: list) -> None:
+        """
+        Finds the address and source line of each VM command, and the
+        code belonging to each function. A label straight after the
+        comment for a function command, or for code generated by the
+        translator such as the shared call routine, starts a new function.
+        """
+        sources = dict(zip(commentLines, sourceMap))
+        function = TOP_LEVEL
+        starting = False            # the previous line may be followed by a function's label
+        for i, line in enumerate(lines):
+            if i in sources:
+                progname, number = sources[i]
+                end = line.index(']', 4)
+                text = line[end + 1:].strip()
+                self.starts.append(int(line[4:end]))
+                self.commands.append([progname, number, text, function])
+                starting = text.startswith('function ') or text.startswith('*')
+            elif line.startswith('(') and starting:
+                function = line.strip()[1:-1]
+                self.commands[-1][3] = function
+                if self.commands[-1][2].startswith('function '):
+                    self.entries[self.starts[-1]] = function
+                starting = False
+            else:
+                starting = False
+
+    def run(self, maxCycles: int = 10_000_000) -> bool:
+        """Runs the program, returning True if it halted before maxCycles."""
+        return self.emulator.run(maxCycles, self.trace)
+
+    def trace(self, start: int, n: int, address: int) -> None:
+        """Counts a block of instructions and follows calls and returns."""
+        key = (start, n)
+        self.blockCounts[key] = self.blockCounts.get(key, 0) + 1
+        self.pathCycles[self.path] = self.pathCycles.get(self.path, 0) + n
+        ram = self.emulator.ram
+        if address in self.entries:
+            frame = ram[1] - 5          # return address, LCL, ARG, THIS, THAT
+            self.stack.append((ram[frame], ram[frame + 1], self.path))
+            self.path = self.path + (self.entries[address],)
+            self.pathCalls[self.path] = self.pathCalls.get(self.path, 0) + 1
+        elif self.stack and address == self.stack[-1][0] and ram[1] == self.stack[-1][1]:
+            # a tail call leaves more than one call returning to the same place
+            while self.stack and address == self.stack[-1][0] and ram[1] == self.stack[-1][1]:
+                self.path = self.stack.pop()[2]
+
+    def commandCycles(self) -> list:
+        """Returns the cycles spent in the code of each VM command."""
+        addresses = self.addressCounts()
+        ends = self.starts[1:] + [len(self.emulator.rom)]
+        return [sum(addresses[start:end]) for start, end in zip(self.starts, ends)]
+
+    def commandCounts(self) -> list:
+        """Returns the number of times the code of each VM command was started."""
+        addresses = self.addressCounts()
+        return [addresses[start] for start in self.starts]
+
+    def addressCounts(self) -> list:
+        """Returns the number of times each instruction was executed."""
+        addresses = [0] * (len(self.emulator.rom) + 1)
+        for (start, n), count in self.blockCounts.items():
+            addresses[start] += count
+            addresses[start + n] -= count
+        total = 0
+        for i in range(len(addresses)):
+            total += addresses[i]
+            addresses[i] = total
+        return addresses
+
+    def report(self, top: int = 20, minPercent: float = 1.0) -> str:
+        """
+        Returns the flat profiles by function and by VM source line (the
+        top lines only), and the call tree down to paths taking at least
+        minPercent of the cycles.
+        """
+        cycles = self.commandCycles()
+        total = self.emulator.cycles or 1
+        lines = [f'Profile: {self.emulator.cycles} cycles'
+                 + ('' if self.emulator.halted else ' (cycle limit reached)')]
+
+        byFunction = {}
+        for (progname, number, text, function), n in zip(self.commands, cycles):
+            byFunction[function] = byFunction.get(function, 0) + n
+        calls = {}
+        for path, count in self.pathCalls.items():
+            calls[path[-1]] = calls.get(path[-1], 0) + count
+        lines.append('Cycles by function:')
+        lines.append(f'  {"cycles":>10} {"%":>6} {"calls":>8}  function')
+        for function, n in sorted(byFunction.items(), key=lambda item: -item[1]):
+            if n:
+                lines.append(f'  {n:>10} {100 * n / total:>5.1f}% {calls.get(function, ""):>8}  {function}')
+
+        byLine = {}
+        for (progname, number, text, function), n in zip(self.commands, cycles):
+            key = (progname, number) if number else (function, text)
+            if key in byLine:
+                byLine[key][0] += n
+            else:
+                byLine[key] = [n, f'{progname}.vm:{number}' if number else function, text]
+        lines.append(f'Cycles by VM line (top {top}):')
+        lines.append(f'  {"cycles":>10} {"%":>6}  {"line":<24} command')
+        for n, where, text in sorted(byLine.values(), key=lambda item: -item[0])[:top]:
+            if n:
+                lines.append(f'  {n:>10} {100 * n / total:>5.1f}%  {where:<24} {text}')
+
+        inclusive = dict(self.pathCycles)
+        for path in sorted(self.pathCycles, key=len, reverse=True):
+            for i in range(1, len(path)):
+                inclusive.setdefault(path[:i], 0)
+        for path in sorted(inclusive, key=len, reverse=True):
+            if len(path) > 1:
+                inclusive[path[:-1]] += inclusive[path]
+        children = {}
+        for path in inclusive:
+            children.setdefault(path[:-1], []).append(path)
+        lines.append(f'Call tree (paths with at least {minPercent}% of cycles):')
+        lines.append(f'  {"total":>10} {"%":>6} {"self":>10} {"calls":>8}  function')
+        pending = [(TOP_LEVEL,)]
+        while pending:
+            path = pending.pop()
+            n = inclusive[path]
+            if 100 * n / total < minPercent:
+                continue
+            lines.append(f'  {n:>10} {100 * n / total:>5.1f}% {self.pathCycles.get(path, 0):>10} '
+                         f'{self.pathCalls.get(path, ""):>8}  {"  " * (len(path) - 1)}{path[-1]}')
+            pending += sorted(children.get(path, []), key=lambda p: inclusive[p])
+        return '\n'.join(lines)
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# Translation server: keeps translated files in memory between builds.
+
+import BuildCache
+import vmt
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+class Server:
+    """
+    Long-running translator. Build requests arrive on a Unix socket as a
+    line of JSON, {"argv": [vmt arguments], "cwd": directory}, and are
+    answered with {"status": exit status, "messages": translator output,
+    "seconds": build time}. The translated fragment of each file, its
+    hash and its parsed Commands are kept in a MemoryCache, so a build
+    only translates the files that changed, then links. The sources of
+    each build asked for are polled, and rebuilt as soon as they change,
+    so the next request finds the work done.
+    """
+
+    def __init__(self, socketPath: str, poll: float = 0.5) -> None:
+        self.socketPath = socketPath
+        self.poll = poll
+        self.cache = BuildCache.MemoryCache(vmt.translatorVersion())
+        self.lock = threading.Lock()    # one build at a time, builds change directory
+        self.watched = {}               # (cwd, argv) -> stamps of the source files at the last build
+        self.used = {}                  # (cwd, argv) -> cache keys used by the last build
+
+    def build(self, cwd: str, argv: list) -> dict:
+        """Runs the translator as vmt would with these arguments, with the cache in memory."""
+        with self.lock:
+            start = time.perf_counter()
+            output = io.StringIO()
+            status = 0
+            self.cache.startBuild()
+            try:
+                os.chdir(cwd)
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    stamps = sourceStamps(argv)
+                    vmt.main(argv, self.cache)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                status = 1
+                output.write(f'Error: {type(e).__name__}: {str(e)}\n')
+            else:
+                self.watched[(cwd, tuple(argv))] = stamps
+                self.used[(cwd, tuple(argv))] = self.cache.used
+                # drop the fragments of files since edited, which no build will ask for again
+                self.cache.discard(set().union(*self.used.values()))
+            return {'status': status, 'messages': output.getvalue(),
+                    'seconds': round(time.perf_counter() - start, 4)}
+
+    def watch(self) -> None:
+        """Polls the sources of each build and rebuilds the ones that changed."""
+        while True:
+            time.sleep(self.poll)
+            self.rebuildChanged()
+
+    def rebuildChanged(self) -> int:
+        """Rebuilds each watched build whose sources changed. Returns the number rebuilt."""
+        rebuilt = 0
+        for (cwd, argv), stamps in list(self.watched.items()):
+            try:
+                with self.lock:
+                    os.chdir(cwd)
+                    changed = sourceStamps(list(argv)) != stamps
+            except OSError:
+                changed = True      # e.g. a file removed: let the build report it
+            if changed:
+                result = self.build(cwd, list(argv))
+                rebuilt += 1
+                print(f'Rebuilt {" ".join(argv)} in {cwd}: status {result["status"]}, '
+                      f'{1000 * result["seconds"]:.0f}ms', file=sys.stderr)
+                if result['status']:
+                    # don't retry a failing build until the files change again
+                    with self.lock:
+                        try:
+                            self.watched[(cwd, argv)] = sourceStamps(list(argv))
+                        except OSError:
+                            del self.watched[(cwd, argv)]
+                            self.used.pop((cwd, argv), None)
+        return rebuilt
+
+    def serve(self) -> None:
+        """Accepts build requests until interrupted."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                try:
+                    request = json.loads(self.rfile.readline())
+                    result = server.build(request['cwd'], request['argv'])
+                    print(f'Built {" ".join(request["argv"])}: status {result["status"]}, '
+                          f'{1000 * result["seconds"]:.0f}ms', file=sys.stderr)
+                except (ValueError, KeyError, TypeError) as e:
+                    result = {'status': 1, 'messages': f'Invalid request: {str(e)}\n', 'seconds': 0}
+                self.wfile.write(json.dumps(result).encode() + b'\n')
+
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        threading.Thread(target=self.watch, daemon=True).start()
+        with socketserver.UnixStreamServer(self.socketPath, Handler) as unixServer:
+            print(f'Translation server listening on {self.socketPath}', file=sys.stderr)
+            try:
+                unixServer.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(self.socketPath)
+
+def sourceStamps(argv: list) -> list:
+    """
+    Returns the name, modification time and size of each .vm file a
+    translator command line reads, to tell when they change. The
+    command line is parsed as vmt.py parses it, so the values of options
+    such as --cache or --stats-json are not taken for the source.
+    """
+    try:
+        source = vmt.makeArgParser().parse_args(argv).source
+    except SystemExit:
+        return []       # the build reports the error
+    if os.path.isdir(source):
+        files = sorted(e.path for e in os.scandir(source) if e.is_file() and e.name.endswith('.vm'))
+    elif os.path.isfile(source):
+        files = [source]
+    else:
+        return []
+    return [(file, BuildCache.fileStamp(file)) for file in files]
+
+def request(socketPath: str, argv: list) -> dict:
+    """Sends a build request to a running server and returns its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socketPath)
+        s.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode() + b'\n')
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(
+        description='Translation server for the Hack VM translator. Without translator '
+                    'arguments, runs the server; with them, asks the server for a build.')
+    argParser.add_argument('--poll', type=float, default=0.5, metavar='SECONDS',
+        help='How often the server checks the sources for changes (default 0.5)')
+    argParser.add_argument('socket', help='Path of the Unix socket')
+    argParser.add_argument('argv', nargs=argparse.REMAINDER,
+        help='Translator arguments, as for vmt.py')
+    args = argParser.parse_args()
+    if not args.argv:
+        Server(args.socket, args.poll).serve()
+        return
+    try:
+        result = request(args.socket, args.argv)
+    except OSError as e:
+        print(f'Error: Cannot reach the server at {args.socket}: {str(e)}', file=sys.stderr)
+        sys.exit(1)
+    sys.stderr.write(result['messages'])
+    print(f'Build took {1000 * result["seconds"]:.0f}ms', file=sys.stderr)
+    sys.exit(result['status'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import contextlib
+import cProfile
+import pstats
+import time
+
+BOOTSTRAP = '(bootstrap)'       # code before the first function
+RUNTIME = '(runtime)'           # shared routines written by the translator, and the final loop
+
+# comment text of code generated by CodeWriter or Inliner -> kind of command it is counted as
+GENERATED = {
+    '*initialize': 'function',
+    '*copy return': 'return',
+    '*shared call routine': 'call routine',
+    '*shared return routine': 'return routine',
+    '*tail call routine': 'tail call routine',
+    '*infinite loop': 'halt',
+    '*inline local': 'inlining',
+    '*save pointer': 'inlining',
+    '*restore pointer': 'inlining',
+}
+
+# kinds of command whose code is the cost of calls and returns, see overhead()
+CALL_KINDS = ('call', 'call+return', 'call routine', 'tail call routine')
+RETURN_KINDS = ('return', 'return routine')
+
+class Stats:
+    """
+    Statistics of a translation: the time spent in each phase, and the
+    ROM words of the code for each kind of VM command and each function.
+    The words are counted from the '// [address] command' comments
+    CodeWriter records in the code as it writes it, so they are the
+    words of the final code, after the peephole optimizer. Optionally,
+    the translation is profiled with cProfile.
+    """
+
+    def __init__(self, profile: bool = False) -> None:
+        self.phases = {}            # phase -> seconds
+        self.byKind = {}            # kind of VM command -> [commands, words]
+        self.byFunction = {}        # function -> [commands, words]
+        self.words = 0
+        self.function = BOOTSTRAP   # function of the code being counted
+        self.command = None         # (kind, function, address) of the last command, its words not yet known
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Adds the time taken by the code in the with block to the phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.perf_counter() - start)
+
+    def addTime(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def profiling(self):
+        """Profiles the code in the with block, if profiling."""
+        if self.profiler:
+            self.profiler.enable()
+        try:
+            yield
+        finally:
+            if self.profiler:
+                self.profiler.disable()
+
+    def addCode(self, lines: list, addressComments: list) -> None:
+        """
+        Counts lines of assembly code, given in order, any number at a
+        time, with the indices in lines of the address comments.
+        """
+        for i in addressComments:
+            line = lines[i]
+            end = line.index(']', 4)
+            address = int(line[4:end])
+            text = line[end + 1:].strip()
+            self.endCommand(address)
+            kind = commandKind(text)
+            if text.startswith('function '):
+                self.function = text.split()[1]
+            elif kind in ('call routine', 'return routine', 'tail call routine', 'halt'):
+                self.function = RUNTIME
+            self.command = (kind, self.function, address)
+
+    def endCommand(self, address: int) -> None:
+        """Counts the words of the last command, which end at address."""
+        if self.command is None:
+            # the code before the first comment sets up the stack
+            self.command = ('bootstrap', BOOTSTRAP, 0)
+        kind, function, start = self.command
+        for counts, key in ((self.byKind, kind), (self.byFunction, function)):
+            entry = counts.setdefault(key, [0, 0])
+            entry[0] += 1
+            entry[1] += address - start
+
+    def finish(self, words: int) -> None:
+        """Ends the counts at the end of the code, words long."""
+        self.endCommand(words)
+        self.command = None
+        self.words = words
+
+    def overhead(self) -> dict:
+        """
+        Returns the words of the bootstrap, and of function entry, calls
+        and returns, including the shared routines. The bootstrap's call
+        of Sys.init is in both the bootstrap and the calls.
+        """
+        def words(kinds):
+            return sum(self.byKind.get(kind, (0, 0))[1] for kind in kinds)
+        return {'bootstrap': self.byFunction.get(BOOTSTRAP, (0, 0))[1],
+                'function entry': words(('function',)),
+                'call': words(CALL_KINDS),
+                'return': words(RETURN_KINDS)}
+
+    def profile(self, top: int = 20) -> list:
+        """Returns the top functions from the profile by cumulative time, if profiling."""
+        if not self.profiler:
+            return []
+        rows = []
+        for (file, line, name), (primitive, calls, seconds, cumulative, callers) in pstats.Stats(self.profiler).stats.items():
+            rows.append({'function': f'{file}:{line}({name})' if line else name, 'calls': calls,
+                         'seconds': round(seconds, 6), 'cumulative': round(cumulative, 6)})
+        return sorted(rows, key=lambda row: -row['cumulative'])[:top]
+
+    def dumpProfile(self, filename: str) -> None:
+        """Writes the profile for pstats, e.g. python -m pstats filename."""
+        self.profiler.dump_stats(filename)
+
+    def toDict(self) -> dict:
+        """Returns the statistics, for JSON."""
+        result = {
+            'words': self.words,
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'byKind': {kind: {'commands': n, 'words': words} for kind, (n, words) in self.byKind.items()},
+            'byFunction': {name: {'commands': n, 'words': words} for name, (n, words) in self.byFunction.items()},
+            'overhead': self.overhead(),
+        }
+        if self.profiler:
+            result['profile'] = self.profile()
+        return result
+
+    def report(self, top: int = 20) -> str:
+        """Returns the statistics as tables, with the top functions by words."""
+        total = self.words or 1
+        seconds = sum(self.phases.values()) or 1
+        lines = [f'Statistics: {self.words} words of ROM, {sum(self.phases.values()):.3f}s']
+        lines.append('Time by phase:')
+        lines.append(f'  {"seconds":>10} {"%":>6}  phase')
+        for name, s in self.phases.items():
+            lines.append(f'  {s:>10.4f} {100 * s / seconds:>5.1f}%  {name}')
+        lines.append('Words by VM command:')
+        lines.append(f'  {"commands":>8} {"words":>8} {"each":>6} {"%":>6}  command')
+        for kind, (n, words) in sorted(self.byKind.items(), key=lambda item: -item[1][1]):
+            lines.append(f'  {n:>8} {words:>8} {words / n:>6.1f} {100 * words / total:>5.1f}%  {kind}')
+        lines.append(f'Words by function (top {top}):')
+        lines.append(f'  {"commands":>8} {"words":>8} {"%":>6}  function')
+        for name, (n, words) in sorted(self.byFunction.items(), key=lambda item: -item[1][1])[:top]:
+            lines.append(f'  {n:>8} {words:>8} {100 * words / total:>5.1f}%  {name}')
+        lines.append('Overhead:')
+        for name, words in self.overhead().items():
+            lines.append(f'  {words:>8} words {100 * words / total:>5.1f}%  {name}')
+        if self.profiler:
+            lines.append('Python profile (by cumulative time):')
+            lines.append(f'  {"calls":>8} {"seconds":>9} {"cumulative":>10}  function')
+            for row in self.profile():
+                lines.append(f'  {row["calls"]:>8} {row["seconds"]:>9.4f} {row["cumulative"]:>10.4f}  {row["function"]}')
+        return '\n'.join(lines)
+
+def commandKind(text: str) -> str:
+    """
+    Returns the kind of VM command an address comment is for: the command
+    name, names joined with + for commands combined into one, e.g.
+    'lt+if-goto', or a kind from GENERATED for generated code.
+    """
+    if text.startswith('*'):
+        for prefix, kind in GENERATED.items():
+            if text.startswith(prefix):
+                return kind
+        return text[1:]
+    text = text.split('//')[0]
+    if text.endswith('(inlined)'):
+        return text.split()[0] + ' (inlined)'
+    return '+'.join(part.split()[0] for part in text.split(';') if part.split()) or 'comment'
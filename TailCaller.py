@@ -0,0 +1,55 @@
+from Parser import Command, CommandType
+
+class TailCaller:
+    """
+    Optimization pass over the Commands from Parser, before CodeWriter.
+    A call followed straight away by return becomes a single C_CALL
+    Command with arg0 'tail', which CodeWriter translates as a jump
+    that reuses the current frame: the arguments are moved down to
+    where the current function's arguments are, and the called
+    function returns straight to our caller. Deep recursion then runs
+    in constant stack space, and the return from the current function
+    is not needed.
+    """
+
+    def __init__(self) -> None:
+        self.removed = {'tail-calls': 0}
+
+    def optimize(self, commands):
+        """Yields the optimized Commands for an iterable of Commands."""
+        call = None                 # a call not yet written, in case return follows
+        comments = []               # comments after the call
+        for cmd in commands:
+            t = cmd.type
+            if call:
+                if t is CommandType.C_COMMENT:
+                    comments.append(cmd)
+                    continue
+                if t is CommandType.C_RETURN and cmd.arg0 == 'return':
+                    self.removed['tail-calls'] += 1
+                    yield Command(CommandType.C_CALL, f'{call.text.strip()}; {cmd.text.strip()}', call.line,
+                                  'tail', call.arg1, call.index)
+                    yield from comments
+                    call = None
+                    comments = []
+                    continue
+                yield call
+                yield from comments
+                call = None
+                comments = []
+            if t is CommandType.C_CALL and cmd.arg0 == 'call':
+                call = cmd
+                continue
+            yield cmd
+        if call:
+            yield call
+            yield from comments
+
+    def add(self, other: 'TailCaller') -> None:
+        """Adds the counts of another TailCaller, e.g. one used in a worker process."""
+        for name, n in other.removed.items():
+            self.removed[name] += n
+
+    def report(self) -> str:
+        """Returns the number of calls made into tail calls."""
+        return f'Tail calls: {self.removed["tail-calls"]} call and return pairs made into tail calls'
@@ -0,0 +1,191 @@
+import CallGraph
+import CodeWriter
+import Inliner
+import Parser
+from Parser import CommandType
+import Peephole
+import Pipeline
+from Pipeline import SourceError, TranslationError
+import Stats
+import contextlib
+import itertools
+import os
+
+CHUNK_COMMANDS = 64     # Commands written between checks for output to yield
+
+class Translator:
+    """
+    Translates VM code held in memory, for programs that embed the
+    translator: no files are read or written and nothing is printed.
+    The sources are given as strings or iterables of lines, and the
+    assembly code is yielded a chunk at a time as it is generated.
+    Errors raise TranslationError rather than exiting. A Translator can
+    be used for any number of translations with the same options.
+    """
+
+    def __init__(self, peephole: bool = False, fold: bool = False, fuseBranches: bool = False,
+                 tailCalls: bool = False, inline: bool = False, inlineSize: int = 12,
+                 prune: bool = False, chunkLines: int = 8192, stats: bool = False, **options) -> None:
+        """
+        The options are those of vmt.py. peephole, fold, fuseBranches,
+        tailCalls and inline turn on the optimizations, inlining
+        functions of up to inlineSize commands, and prune leaves out the
+        functions Sys.init never calls. The other options, e.g.
+        sharedCallReturn or cacheTop, are given to CodeWriter, except
+        hack: assemble the code with Assembler instead. Code is
+        yielded in chunks of about chunkLines lines. If stats is true,
+        each translation keeps Stats, as vmt.py --stats; the files are
+        then parsed whole, to time the phases apart.
+        """
+        self.peephole = peephole
+        self.passOptions = {'fold': fold, 'fuse': fuseBranches, 'tail': tailCalls}
+        self.inline = inline
+        self.inlineSize = inlineSize
+        self.prune = prune
+        self.chunkLines = chunkLines
+        self.collectStats = stats
+        self.options = options
+        if options.get('localInit', 'push') not in CodeWriter.LOCAL_INIT:
+            raise ValueError(f'localInit must be one of {", ".join(CodeWriter.LOCAL_INIT)}')
+        if options.get('hack'):
+            raise ValueError('hack is not supported, the code is assembly: give it to an Assembler')
+        CodeWriter.CodeWriter(**options)    # an unknown option raises TypeError here, not on the first translation
+        self.writer = None          # CodeWriter of the last translation started, for its reports
+        self.passes = []            # its optimization passes
+        self.graph = None           # its CallGraph, if pruning
+        self.stats = None           # its Stats, complete when all its code has been yielded
+
+    def translate(self, sources):
+        """
+        Yields the lines of assembly code, each ending in a newline, for
+        sources: a dict, or an iterable of pairs, of file name (with or
+        without .vm) and VM code, as a string or an iterable of lines.
+        The bootstrap code is written first if there is a Sys file. An
+        invalid line raises SourceError when it is reached, after the
+        code before it has been yielded; when inlining or pruning, all
+        the files are parsed before any code is yielded.
+        """
+        files = sourceFiles(sources)
+        stats = Stats.Stats() if self.collectStats else None
+        self.stats = stats
+        phase = stats.phase if stats else lambda name: contextlib.nullcontext()
+        output = Output()
+        writer = CodeWriter.CodeWriter(peephole=Peephole.Peephole() if self.peephole else None,
+                                       quiet=True, **self.options)
+        writer.stats = stats
+        writer.stream(None, self.chunkLines, output)
+        self.writer = writer
+        if any(name == 'Sys' for name, lines in files):
+            with phase('codegen'):
+                writer.setFilename('Sys.vm')
+                writer.writeBootstrap()
+            yield from output.take()
+
+        parsed = [(name, checked(name, Parser.Parser(name + '.vm', lines=lines, quiet=True).commands()))
+                  for name, lines in files]
+        passOptions = dict(self.passOptions)
+        if self.inline or self.prune or stats:
+            with phase('parse'):
+                parsed = [(name, list(commands)) for name, commands in parsed]
+        if self.inline:
+            inliner = Inliner.Inliner(self.inlineSize)
+            with phase('analyze'):
+                for name, commands in parsed:
+                    inliner.addFile(commands)
+            passOptions['inline'] = inliner.functions
+        self.passes = Pipeline.makePasses(passOptions)
+        reachable = None
+        dropped = None
+        self.graph = None
+        if self.prune:
+            self.graph = CallGraph.CallGraph()
+            with phase('analyze'):
+                for name, commands in parsed:
+                    self.graph.addFile(name, commands)
+            if 'Sys.init' in self.graph.files:
+                reachable = self.graph.reachable()
+                dropped = CodeWriter.CodeWriter(quiet=True, **self.options)
+
+        for name, commands in parsed:
+            # as vmt.translateFile(), with the Commands written a chunk at a time
+            if stats:
+                with phase('optimize'):
+                    for p in self.passes:
+                        commands = list(p.optimize(commands))
+            else:
+                for p in self.passes:
+                    commands = p.optimize(commands)
+            writer.setFilename(name + '.vm')
+            if dropped:
+                dropped.progname = writer.progname
+            commands = iter(commands)
+            w = None
+            while True:
+                with phase('codegen'):
+                    chunk = list(itertools.islice(commands, CHUNK_COMMANDS))
+                    if chunk:
+                        w = Pipeline.writeCommands(writer, chunk, reachable, dropped, w)
+                if not chunk:
+                    break
+                yield from output.take()
+            writer.spillTop()
+            if dropped:
+                dropped.spillTop()
+        with phase('codegen'):
+            writer.close(None)
+        lines = output.take()
+        if stats:
+            stats.finish(writer.words)
+        yield from lines
+
+    def translateText(self, sources) -> str:
+        """Returns the assembly code for sources, as translate(), as one string."""
+        return ''.join(self.translate(sources))
+
+class Output:
+    """Receives the code CodeWriter writes when streaming, until translate() yields it."""
+
+    def __init__(self) -> None:
+        self.lines = []
+
+    def writelines(self, lines: list) -> None:
+        self.lines += lines
+
+    def close(self) -> None:
+        pass
+
+    def take(self) -> list:
+        """Returns the lines received since the last call."""
+        lines = self.lines
+        self.lines = []
+        return lines
+
+def sourceFiles(sources) -> list:
+    """Returns (name without .vm, lines) for each source given to translate()."""
+    items = sources.items() if isinstance(sources, dict) else sources
+    files = []
+    names = set()
+    for filename, code in items:
+        name = os.path.basename(filename)
+        if name.endswith('.vm'):
+            name = name[:-3]
+        if not name.isidentifier():
+            raise TranslationError(f'Invalid file name {filename!r}, static variables are named after it')
+        if name in names:
+            raise TranslationError('File given more than once', name)
+        names.add(name)
+        files.append((name, code.splitlines() if isinstance(code, str) else code))
+    if not files:
+        raise TranslationError('No VM source files given')
+    return files
+
+def checked(name: str, commands):
+    """Yields the Commands, raising SourceError at an invalid one."""
+    for cmd in commands:
+        if cmd.type is CommandType.C_ERROR:
+            raise SourceError(cmd.arg1.partition(' on line ')[0], name, cmd.line, cmd.text)
+        yield cmd
+
+def translate(sources, **options):
+    """Yields the lines of assembly code for sources, see Translator.translate() and its options."""
+    return Translator(**options).translate(sources)
@@ -0,0 +1,20 @@
+# Translates VM programs in memory and runs them in the Emulator, for the tests.
+
+import Translator
+import re
+from Emulator import Emulator
+
+def run(sources: dict, maxCycles: int = 1_000_000, **options) -> dict:
+    """
+    Translates sources, {file name: VM code}, with the Translator options
+    and runs the program until it halts. Returns {symbol: value} for the
+    static variables, e.g. 'Main.0', and the registers SP to THAT.
+    """
+    code = Translator.Translator(**options).translateText(sources)
+    emulator = Emulator(code.splitlines())
+    assert emulator.run(maxCycles), 'program did not halt'
+    values = {name: emulator.ram[address] for name, address in emulator.symbols.items()
+              if re.fullmatch(r'\w+\.\d+', name)}
+    for address, name in enumerate(('SP', 'LCL', 'ARG', 'THIS', 'THAT')):
+        values[name] = emulator.ram[address]
+    return values
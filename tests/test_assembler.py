@@ -0,0 +1,27 @@
+import Assembler
+import pytest
+
+def assemble(lines: list):
+    assembler = Assembler.Assembler()
+    assembler.writelines(lines)
+    return assembler.finish()
+
+def test_program_filling_rom():
+    words = assemble(['@END', '0;JMP'] + ['D=0'] * (Assembler.ROM_SIZE - 3) + ['(END)', '0;JMP'])
+    assert len(words) == Assembler.ROM_SIZE
+    assert words[0] == Assembler.ROM_SIZE - 1
+
+def test_program_too_big_for_rom():
+    with pytest.raises(ValueError):
+        assemble(['D=0'] * (Assembler.ROM_SIZE + 1))
+
+def test_label_out_of_range():
+    # the label is past the end of ROM, and @END would load a C-instruction
+    with pytest.raises(ValueError):
+        assemble(['@END', '0;JMP'] + ['D=0'] * 33000 + ['(END)'])
+    with pytest.raises(ValueError):
+        assemble(['@END', '0;JMP'] + ['D=0'] * (Assembler.ROM_SIZE - 2) + ['(END)'])
+
+def test_constant_out_of_range():
+    with pytest.raises(ValueError):
+        assemble(['@32768'])
@@ -0,0 +1,27 @@
+import Batch
+from Benchmark import ProgramGenerator
+
+# a long function with no calls, so only the assembler's check of the size of ROM can find it too big
+LONG = 'function Sys.init 0\n' + 'push constant 1\npop temp 0\n' * 3000 + 'label END\ngoto END\n'
+
+def writeProject(directory, sources: dict) -> str:
+    directory.mkdir()
+    for name, code in sources.items():
+        (directory / f'{name}.vm').write_text(code)
+    return str(directory)
+
+def test_program_too_big_for_rom(tmp_path):
+    small = writeProject(tmp_path / 'Small', ProgramGenerator(1).generate('calls', 100))
+    big = writeProject(tmp_path / 'Big', {'Sys': LONG})
+    (tmp_path / 'Big' / 'Big.hack').write_text('earlier output\n')
+    results = [Batch.translateProject(source, {}, hack=True) for source in (small, big)]
+
+    assert results[0]['status'] == 'ok'
+    assert (tmp_path / 'Small' / 'Small.hack').exists()
+    # the failure is reported, and the earlier output is left as it was
+    assert results[1]['status'] == 'error'
+    assert results[1]['error']['type'] == 'ValueError'
+    assert 'ROM' in results[1]['error']['message']
+    assert results[1]['output'] is None
+    assert (tmp_path / 'Big' / 'Big.hack').read_text() == 'earlier output\n'
+    assert sorted(path.name for path in (tmp_path / 'Big').iterdir()) == ['Big.hack', 'Sys.vm']
@@ -0,0 +1,81 @@
+from BuildCache import BuildCache
+import os
+import vmt
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+MAIN = '''function Main.main 0
+push constant {value}
+return
+'''
+
+OPTIONS = {'sharedCallReturn': False, 'cacheTop': False}
+
+def test_key_changes_with_source_and_options(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'), 1024 * 1024, '1')
+    main = tmp_path / 'Main.vm'
+    main.write_text(MAIN.format(value=1))
+    key = cache.key(str(main), OPTIONS)
+    assert cache.key(str(main), dict(OPTIONS)) == key
+    assert cache.key(str(main), dict(OPTIONS, cacheTop=True)) != key
+    assert cache.key(str(main), OPTIONS, 'Main.main') != key
+    assert BuildCache(str(tmp_path / 'cache'), 1024 * 1024, '2').key(str(main), OPTIONS) != key
+    # the same contents in a file of another name give static variables of another name
+    other = tmp_path / 'Other.vm'
+    other.write_text(MAIN.format(value=1))
+    assert cache.key(str(other), OPTIONS) != key
+    main.write_text(MAIN.format(value=2))
+    assert cache.key(str(main), OPTIONS) != key
+    main.write_text(MAIN.format(value=1))
+    assert cache.key(str(main), OPTIONS) == key
+
+def test_get_and_put(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'), 1024 * 1024, '1')
+    assert not cache.contains('a') and cache.get('a') is None
+    cache.put('a', ['fragment'], 1.5)
+    assert cache.contains('a')
+    assert cache.get('a') == ['fragment']
+    assert (cache.hits, cache.misses, cache.secondsSaved) == (1, 1, 1.5)
+    # an unreadable entry is discarded
+    with open(cache.path('b'), 'wb') as f:
+        f.write(b'not a pickle')
+    assert cache.get('b') is None and not cache.contains('b')
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'), 1024 * 1024, '1')
+    for i, key in enumerate('abcd'):
+        cache.put(key, 'x' * 1000, 0)
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+    assert cache.evict() == 0
+    size = os.path.getsize(cache.path('a'))
+    cache.maxBytes = 2 * size
+    cache.get('a')                  # now the most recently used
+    assert cache.evict() == 2
+    assert [key for key in 'abcd' if cache.contains(key)] == ['a', 'd']
+
+def test_rebuild_translates_only_changed_files(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    project = tmp_path / 'Prog'
+    project.mkdir()
+    (project / 'Sys.vm').write_text(SYS)
+    (project / 'Main.vm').write_text(MAIN.format(value=1))
+    argv = ['--cache', 'cache', 'Prog']
+
+    def build() -> str:
+        vmt.main(argv)
+        return capsys.readouterr().err
+
+    assert 'Build cache: 0 hits, 2 misses' in build()
+    first = (project / 'Prog.asm').read_text()
+    assert 'Build cache: 2 hits, 0 misses' in build()
+    assert (project / 'Prog.asm').read_text() == first
+    (project / 'Main.vm').write_text(MAIN.format(value=12345))
+    assert 'Build cache: 1 hits, 1 misses' in build()
+    assert '@12345' in (project / 'Prog.asm').read_text()
+    argv.insert(0, '--cache-top')
+    assert 'Build cache: 0 hits, 2 misses' in build()
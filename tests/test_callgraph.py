@@ -0,0 +1,77 @@
+from CallGraph import CallGraph
+import Parser
+import Translator
+from emulate import run
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+# Main.a and Main.b call each other, Main.unused and Util.dead are never called,
+# and Os.missing is not defined in any file
+MAIN = '''function Main.main 0
+push constant 3
+call Main.a 1
+pop static 0
+push constant 0
+return
+function Main.a 0
+push argument 0
+push constant 0
+eq
+if-goto Main.a$DONE
+push argument 0
+push constant 1
+sub
+call Main.b 1
+return
+label Main.a$DONE
+push constant 10
+return
+function Main.b 0
+push argument 0
+call Main.a 1
+push constant 1
+add
+return
+function Main.unused 0
+call Util.dead 0
+call Os.missing 0
+return
+'''
+
+UTIL = '''function Util.dead 0
+call Main.main 0
+return
+'''
+
+SOURCES = {'Sys': SYS, 'Main': MAIN, 'Util': UTIL}
+
+def graph() -> CallGraph:
+    g = CallGraph()
+    for name, code in SOURCES.items():
+        g.addFile(name, list(Parser.Parser(name + '.vm', lines=code.splitlines(), quiet=True).commands()))
+    return g
+
+def test_reachable():
+    g = graph()
+    assert g.reachable() == {'', 'Sys.init', 'Main.main', 'Main.a', 'Main.b'}
+    assert g.unreachable() == ['Main.unused', 'Util.dead']
+    assert g.files['Util.dead'] == 'Util'
+    # code outside any function is always reachable, and undefined functions are left out
+    assert g.reachable('Main.unused') == {'', 'Main.unused', 'Util.dead', 'Main.main', 'Main.a', 'Main.b'}
+    assert g.reachable('Os.missing') == {''}
+
+def test_prune_leaves_out_unreachable_functions():
+    code = Translator.Translator().translateText(SOURCES)
+    pruned = Translator.Translator(prune=True).translateText(SOURCES)
+    assert '(Main.unused)' in code and '(Util.dead)' in code
+    assert '(Main.unused)' not in pruned and '(Util.dead)' not in pruned
+    assert '(Main.a)' in pruned and '(Main.b)' in pruned
+
+def test_pruned_program_runs_the_same():
+    values = run(SOURCES, prune=True)
+    assert values['Main.0'] == run(SOURCES)['Main.0'] == 13
@@ -0,0 +1,63 @@
+import Assembler
+from Emulator import Emulator
+
+# R0 = R0 + R1 in a loop of R1 times, then halt at a jump to itself
+LOOP = ['@R1', 'D=M', '@END', 'D;JEQ',
+        '(LOOP)', '@R2', 'M=M+1', '@R1', 'MD=M-1', '@LOOP', 'D;JGT',
+        '(END)', '@END', '0;JMP']
+
+def test_halts_at_jump_to_itself():
+    emulator = Emulator(LOOP, {1: 3})
+    assert emulator.run()
+    assert emulator.halted
+    assert emulator.ram[2] == 3
+    assert emulator.pc == 10        # the (END) loop
+
+def test_halts_at_finis():
+    emulator = Emulator(['@7', 'D=A', '@R5', 'M=D', '(__FINIS__)', '@__FINIS__', '0;JMP'])
+    assert emulator.run()
+    # run into without a jump, the loop is run once before it is found
+    assert emulator.cycles == 6
+    assert emulator.ram[5] == 7
+
+def test_cycles_are_instructions_executed():
+    # 4 before the loop, 6 per time round it; the halting loop is not counted
+    for n in (0, 1, 5):
+        emulator = Emulator(LOOP, {1: n})
+        emulator.run()
+        assert emulator.cycles == 4 + 6 * n
+
+def test_cycle_limit():
+    emulator = Emulator(['(SPIN)', 'D=D+1', '@SPIN', '0;JMP'])
+    assert not emulator.run(10)
+    assert not emulator.halted
+    assert emulator.cycles == 10
+    # it goes on from where it stopped
+    assert not emulator.run(15)
+    assert emulator.cycles == 15
+    assert emulator.d == 5
+
+def test_jump_uses_a_from_before_the_instruction():
+    # A=A+1;JMP jumps to the address in A before it is incremented
+    emulator = Emulator(['@4', 'A=A+1;JMP', '@R1', 'M=1', '@R2', 'M=1', '(END)', '@END', '0;JMP'])
+    assert emulator.run()
+    assert (emulator.ram[1], emulator.ram[2]) == (0, 1)
+
+def test_arithmetic_wraps_to_16_bits():
+    emulator = Emulator(['@32767', 'D=A', 'D=D+1', '@R0', 'M=D', 'D=-D', '@R1', 'M=D', '(END)', '@END', '0;JMP'])
+    emulator.run()
+    assert emulator.ram[0] == -32768
+    assert emulator.ram[1] == -32768
+
+def test_machine_code():
+    assembler = Assembler.Assembler()
+    assembler.writelines(LOOP)
+    words = [f'{word:016b}' for word in assembler.finish()]
+    emulator = Emulator(words, {1: 4}, machineCode=True)
+    assert emulator.run()
+    assert emulator.ram[2] == 4
+
+def test_jump_uses_a_from_before_the_instruction_when_loaded_from_ram():
+    emulator = Emulator(['@R3', 'A=M', 'A=A+1;JMP', '@R1', 'M=1', '@R2', 'M=1', '(END)', '@END', '0;JMP'], {3: 5})
+    assert emulator.run()
+    assert (emulator.ram[1], emulator.ram[2], emulator.ram[6]) == (0, 1, 0)
@@ -0,0 +1,53 @@
+from emulate import run
+
+SYS = '''
+function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+# Main.set is a leaf that changes THIS and THAT, which the caller must get back
+POINTERS = '''
+function Main.main 0
+push constant 3000
+pop pointer 0
+push constant 4000
+pop pointer 1
+push constant 7000
+push constant 8000
+call Main.set 2
+pop static 0
+push pointer 0
+pop static 1
+push pointer 1
+pop static 2
+push constant 0
+return
+function Main.set 0
+push argument 0
+pop pointer 0
+push argument 1
+pop pointer 1
+push argument 1
+pop this 0
+push this 0
+push that 0
+add
+return
+'''
+
+def test_inline_restores_pointers():
+    sources = {'Sys': SYS, 'Main': POINTERS}
+    expected = {'Main.0': 8000, 'Main.1': 3000, 'Main.2': 4000}
+    for options in ({}, {'inline': True}, {'inline': True, 'peephole': True, 'cacheTop': True}):
+        values = run(sources, **options)
+        assert {name: values[name] for name in expected} == expected, options
+
+def test_inline_restores_pointers_with_locals():
+    # the saved pointers are above the locals, and the body leaves values on the stack
+    main = POINTERS.replace('function Main.set 0', 'function Main.set 2').replace(
+        'push argument 1\npop this 0', 'push argument 1\npop local 1\npush local 1\npop this 0')
+    values = run({'Sys': SYS, 'Main': main}, inline=True, inlineSize=16)
+    assert (values['Main.0'], values['Main.1'], values['Main.2']) == (8000, 3000, 4000)
@@ -0,0 +1,64 @@
+import CodeWriter
+import Parser
+import Pipeline
+import vmt
+import pytest
+
+FIRST = '''function First.main 1
+push constant 3
+call Second.double 1
+pop local 0
+label LOOP
+goto LOOP
+'''
+
+# a VM comment that looks like an address comment, passed through as it is
+SECOND = '''// [3] see section [3] of the spec
+function Second.double 0
+push argument 0
+push argument 0
+add
+push argument 0
+push constant 0
+gt
+if-goto POSITIVE
+return
+label POSITIVE
+return
+'''
+
+def writeFile(writer: CodeWriter.CodeWriter, name: str, code: str) -> None:
+    writer.setFilename(name + '.vm')
+    Pipeline.writeCommands(writer, Parser.Parser(name + '.vm', lines=code.splitlines(), quiet=True).commands())
+    writer.spillTop()
+
+@pytest.mark.parametrize('options', ({}, {'sharedCallReturn': True}, {'cacheTop': True}))
+def test_link_matches_sequential_translation(options):
+    sequential = CodeWriter.CodeWriter(quiet=True, **options)
+    writeFile(sequential, 'First', FIRST)
+    writeFile(sequential, 'Second', SECOND)
+
+    linked = CodeWriter.CodeWriter(quiet=True, **options)
+    writeFile(linked, 'First', FIRST)
+    fragment = CodeWriter.CodeWriter(quiet=True, **options)
+    writeFile(fragment, 'Second', SECOND)
+    assert fragment.relocs and fragment.addressComments
+    linked.link(fragment)
+
+    # jumps, return addresses and address comments are moved, the VM comment is not
+    assert linked.code == sequential.code
+    assert linked.relocs == sequential.relocs
+    assert linked.addressComments == sequential.addressComments
+    assert linked.words == sequential.words
+    assert '// [3] see section [3] of the spec\n' in linked.code
+
+def test_parallel_output_is_sequential_output(tmp_path):
+    project = tmp_path / 'Prog'
+    project.mkdir()
+    (project / 'First.vm').write_text(FIRST)
+    (project / 'Second.vm').write_text(SECOND)
+    outputs = []
+    for options in ([], ['-j', '2']):
+        vmt.main([str(project), *options])
+        outputs.append((project / 'Prog.asm').read_text())
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,193 @@
+# Differential tests: each optimization must compute the same results as the plain translation.
+
+from Benchmark import ProgramGenerator
+from emulate import run
+import functools
+import pytest
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+# recursion, tail recursion, leaf functions with locals and pointers, constants to fold, and branches
+MAIN = '''function Main.main 2
+push constant 10
+call Main.fib 1
+pop static 0
+push constant 20
+push constant 0
+call Main.sum 2
+pop static 1
+push constant 3000
+pop pointer 0
+push constant 4000
+pop pointer 1
+push constant 7000
+push constant 8000
+call Main.set 2
+pop static 2
+push pointer 0
+pop static 3
+push pointer 1
+pop static 4
+push constant 6
+push constant 3
+call Main.mix 2
+pop local 1
+push local 1
+pop static 5
+push constant 5
+call Main.count 1
+call Util.twice 1
+pop static 6
+push static 6
+push constant 1
+call Util.twice 1
+sub
+neg
+pop static 7
+push constant 0
+return
+function Main.fib 0
+push argument 0
+push constant 2
+lt
+if-goto Main.fib$BASE
+push argument 0
+push constant 1
+sub
+call Main.fib 1
+push argument 0
+push constant 2
+sub
+call Main.fib 1
+add
+return
+label Main.fib$BASE
+push argument 0
+return
+function Main.sum 0
+push argument 0
+push constant 0
+eq
+if-goto Main.sum$DONE
+push argument 0
+push constant 1
+sub
+push argument 1
+push argument 0
+add
+call Main.sum 2
+return
+label Main.sum$DONE
+push argument 1
+return
+function Main.set 1
+push argument 0
+pop pointer 0
+push argument 1
+pop pointer 1
+push argument 1
+pop this 0
+push this 0
+push that 0
+add
+return
+function Main.mix 3
+push constant 2
+push constant 3
+add
+push argument 0
+add
+pop local 0
+push local 0
+push argument 1
+gt
+not
+if-goto Main.mix$SMALL
+push local 0
+push constant 4
+sub
+pop local 2
+label Main.mix$SMALL
+push local 0
+push local 2
+or
+push constant 255
+and
+push local 1
+add
+return
+function Main.count 2
+label Main.count$LOOP
+push local 0
+push argument 0
+lt
+not
+if-goto Main.count$DONE
+push local 1
+push local 0
+add
+pop local 1
+push local 0
+push constant 1
+add
+pop local 0
+goto Main.count$LOOP
+label Main.count$DONE
+push local 1
+return
+'''
+
+UTIL = '''function Util.twice 0
+push argument 0
+push argument 0
+add
+return
+'''
+
+# options of each optimization, all compared with the plain translation
+OPTIONS = {
+    'sharedCallReturn': {'sharedCallReturn': True},
+    'peephole': {'peephole': True},
+    'cacheTop': {'cacheTop': True},
+    'fold': {'fold': True},
+    'fuseBranches': {'fuseBranches': True},
+    'inline': {'inline': True},
+    'tailCalls': {'tailCalls': True},
+    'directAddressing': {'directAddressing': True},
+    'localInit unroll': {'localInit': 'unroll'},
+    'localInit loop': {'localInit': 'loop'},
+    'localInit auto': {'localInit': 'auto'},
+    'all': {'peephole': True, 'cacheTop': True, 'fold': True, 'fuseBranches': True, 'inline': True,
+            'tailCalls': True, 'directAddressing': True, 'localInit': 'auto'},
+    'all, shared calls': {'peephole': True, 'cacheTop': True, 'fold': True, 'fuseBranches': True,
+                          'inline': True, 'tailCalls': True, 'sharedCallReturn': True, 'localInit': 'loop'},
+}
+
+PROGRAMS = {
+    'handwritten': {'Sys': SYS, 'Main': MAIN, 'Util': UTIL},
+    'recursive': ProgramGenerator(1).generate('recursive', 300),
+    'calls': ProgramGenerator(2).generate('calls', 300),
+    'files': ProgramGenerator(3).generate('files', 300),
+}
+
+def statics(values: dict) -> dict:
+    return {name: value for name, value in values.items() if '.' in name}
+
+@functools.lru_cache()
+def expected(program: str) -> dict:
+    """Returns the static variables at the end of the plain translation of a program."""
+    return statics(run(PROGRAMS[program]))
+
+@pytest.mark.parametrize('program', PROGRAMS)
+@pytest.mark.parametrize('name', OPTIONS)
+def test_same_results(program, name):
+    assert statics(run(PROGRAMS[program], **OPTIONS[name])) == expected(program)
+
+def test_handwritten_results():
+    values = run(PROGRAMS['handwritten'])
+    assert [values[f'Main.{i}'] for i in range(8)] == [55, 210, 8000, 3000, 4000, 15, 20, -18]
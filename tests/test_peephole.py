@@ -0,0 +1,44 @@
+import re
+import Translator
+
+MAIN = '''function Main.main 0
+push constant 7
+pop static 0
+{comment}
+push static 0
+push constant 1
+add
+pop static 1
+push constant 0
+return
+'''
+
+def translate(comment: str) -> tuple:
+    translator = Translator.Translator(peephole=True)
+    code = translator.translateText({'Main': MAIN.format(comment=comment)})
+    return code, translator.writer.words
+
+def addressErrors(code: str) -> list:
+    """Returns the address comments that do not give the address of the next instruction."""
+    errors = []
+    address = 0
+    for line in code.splitlines():
+        m = re.match(r'// \[(\d+)\]', line)
+        if m and int(m.group(1)) != address:
+            errors.append(line)
+        elif line.startswith('  ') and not line.strip().startswith('//'):
+            address += 1
+    return errors
+
+def test_indented_comment_is_not_an_instruction():
+    flush, flushWords = translate('// a comment')
+    for comment in ('  // a comment', '      // a comment', '    '):
+        code, words = translate(comment)
+        assert words == flushWords, repr(comment)
+        assert addressErrors(code) == [], repr(comment)
+    assert addressErrors(flush) == []
+
+def test_vm_comment_like_an_address_comment_is_kept():
+    code, words = translate('// [3] see section [3] of the spec')
+    assert '// [3] see section [3] of the spec\n' in code
+    assert addressErrors(code.replace('// [3] see', '// see')) == []
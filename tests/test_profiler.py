@@ -0,0 +1,54 @@
+import CodeWriter
+import Parser
+import Peephole
+import Pipeline
+import Profiler
+import pytest
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+# the first line looks like an address comment, for address 3 in the bootstrap
+MAIN = '''// [3] see section [3] of the spec
+function Main.main 0
+push constant 4
+call Main.square 1
+return
+function Main.square 0
+push argument 0
+push argument 0
+add
+return
+'''
+
+@pytest.mark.parametrize('peephole', (False, True))
+@pytest.mark.parametrize('stream', (False, True))
+def test_source_map(tmp_path, peephole, stream):
+    sources = {'Sys': SYS, 'Main': MAIN}
+    outFilename = str(tmp_path / 'Prog.asm')
+    writer = CodeWriter.CodeWriter(peephole=Peephole.Peephole() if peephole else None, sourceMap=True, quiet=True)
+    if stream:
+        writer.stream(outFilename, chunkLines=16)
+    writer.setFilename('Sys.vm')
+    writer.writeBootstrap()
+    for name, code in sources.items():
+        writer.setFilename(name + '.vm')
+        Pipeline.writeCommands(writer, Parser.Parser(name + '.vm', lines=code.splitlines(), quiet=True).commands())
+        writer.spillTop()
+    writer.close(outFilename)
+    with open(outFilename) as f:
+        profiler = Profiler.Profiler(f.readlines(), writer.sourceMap, writer.commentLines)
+
+    # each command from a file is mapped to its own line, code the translator adds starts with *
+    lines = {name: code.splitlines() for name, code in sources.items()}
+    for progname, number, text, function in profiler.commands:
+        if number and not text.startswith('*'):
+            assert lines[progname][number - 1] == text
+    assert profiler.starts == sorted(profiler.starts)
+    assert profiler.commands[0][:2] == ['Sys', 0]      # the bootstrap
+    assert profiler.run()
+    assert sum(profiler.commandCounts()) > 0
@@ -0,0 +1,34 @@
+import Server
+import pytest
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+MAIN = '''function Main.main 0
+push constant {value}
+return
+'''
+
+@pytest.mark.parametrize('options', (['--stats-json', 'stats.json'], ['--cache', 'cache'],
+                                     ['--cprofile', 'profile.out']))
+def test_watch_rebuilds_only_when_sources_change(tmp_path, monkeypatch, options):
+    monkeypatch.chdir(tmp_path)
+    project = tmp_path / 'Prog'
+    project.mkdir()
+    (project / 'Sys.vm').write_text(SYS)
+    (project / 'Main.vm').write_text(MAIN.format(value=1))
+    server = Server.Server(str(tmp_path / 'socket'))
+    argv = options + ['Prog']
+    assert [file for file, stamp in Server.sourceStamps(argv)] == ['Prog/Main.vm', 'Prog/Sys.vm']
+
+    assert server.build(str(tmp_path), argv)['status'] == 0
+    # the build rewrites the option's file, which is not a source
+    assert server.rebuildChanged() == 0
+    (project / 'Main.vm').write_text(MAIN.format(value=12345))
+    assert server.rebuildChanged() == 1
+    assert server.rebuildChanged() == 0
+    assert '@12345' in (project / 'Prog.asm').read_text()
@@ -0,0 +1,49 @@
+import json
+import vmt
+
+SYS = '''function Sys.init 0
+call Main.main 0
+pop temp 0
+label Sys.init$END
+goto Sys.init$END
+'''
+
+MAIN = '''function Main.main 1
+push constant 5
+pop local 0
+push local 0
+push constant 3
+add
+call Main.double 1
+return
+function Main.double 0
+push argument 0
+push argument 0
+add
+return
+'''
+
+def statsJson(tmp_path, capsys, *args, main: str = MAIN) -> dict:
+    project = tmp_path / 'Prog'
+    project.mkdir(exist_ok=True)
+    (project / 'Sys.vm').write_text(SYS)
+    (project / 'Main.vm').write_text(main)
+    vmt.main([str(project), '--stats-json', '-', *args])
+    # standard output carries only the JSON
+    return json.loads(capsys.readouterr().out)
+
+def test_stats_json_on_stdout(tmp_path, capsys):
+    stats = statsJson(tmp_path, capsys)
+    assert stats['words'] == sum(kind['words'] for kind in stats['byKind'].values())
+    assert stats['byFunction']['Main.double']['words'] > 0
+
+def test_no_cache_phase_without_cache(tmp_path, capsys):
+    assert 'cache' not in statsJson(tmp_path, capsys, '-j', '2')['phases']
+    assert 'cache' in statsJson(tmp_path, capsys, '-j', '2', '--cache', str(tmp_path / 'cache'))['phases']
+
+def test_vm_comment_like_an_address_comment(tmp_path, capsys):
+    main = '// [3] see section [3] of the spec\n' + MAIN
+    for options in ([], ['--stream'], ['-j', '2'], ['--peephole', '--stream']):
+        stats = statsJson(tmp_path, capsys, *options, main=main)
+        assert all(kind['words'] >= 0 for kind in stats['byKind'].values()), options
+        assert stats['words'] == sum(kind['words'] for kind in stats['byKind'].values())
@@ -0,0 +1,45 @@
+from Benchmark import ProgramGenerator
+import pytest
+import vmt
+
+# big enough to be written in several chunks
+PROGRAM = ProgramGenerator(4).generate('files', 2000)
+
+OPTIONS = {
+    'plain': [],
+    'peephole': ['--peephole'],
+    'hack': ['--hack'],
+    'cacheTop': ['--cache-top', '--fold', '--fuse-branches'],
+    'shared calls': ['--shared-calls', '--tail-calls', '--peephole'],
+    'inline, prune': ['--inline', '--prune', '--local-init', 'auto'],
+    'profile': ['--profile', '--direct-addressing'],
+}
+
+def translate(tmp_path, options: list) -> bytes:
+    vmt.main(options + [str(tmp_path / 'Prog')])
+    return (tmp_path / 'Prog' / ('Prog.hack' if '--hack' in options else 'Prog.asm')).read_bytes()
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / 'Prog').mkdir()
+    for name, code in PROGRAM.items():
+        (tmp_path / 'Prog' / (name + '.vm')).write_text(code)
+    return tmp_path
+
+@pytest.mark.parametrize('name', OPTIONS)
+def test_stream_writes_the_same_output(project, name):
+    whole = translate(project, OPTIONS[name])
+    assert len(whole.splitlines()) > 2 * 8192
+    assert translate(project, OPTIONS[name] + ['--stream']) == whole
+
+@pytest.mark.parametrize('options', ([], ['--hack']))
+def test_failed_stream_keeps_the_previous_output(project, options):
+    good = translate(project, options + ['--stream'])
+    # an error after the first chunks have been written
+    with open(project / 'Prog' / 'Zzz.vm', 'w') as f:
+        f.write('function Zzz.f 0\n' + 'push constant 1\npop temp 0\n' * 5000 + 'push nowhere 1\n')
+    with pytest.raises(SystemExit) as e:
+        translate(project, options + ['--stream'])
+    assert e.value.code == 5
+    assert (project / 'Prog' / ('Prog.hack' if options else 'Prog.asm')).read_bytes() == good
+    assert not list((project / 'Prog').glob('*.tmp'))
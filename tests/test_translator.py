@@ -0,0 +1,30 @@
+import CodeWriter
+import Parser
+import Pipeline
+import Translator
+import pytest
+
+def test_hack_is_rejected():
+    with pytest.raises(ValueError):
+        Translator.Translator(hack=True)
+
+def test_invalid_line_raises():
+    with pytest.raises(Translator.SourceError) as info:
+        Translator.Translator().translateText({'Main': 'function Main.f 0\npush constant 1\nfoo bar\n'})
+    assert (info.value.filename, info.value.line) == ('Main', 3)
+
+def test_write_commands_raises_rather_than_exits():
+    commands = Parser.Parser('Main.vm', lines=['push constant 1', 'foo bar'], quiet=True).commands()
+    writer = CodeWriter.CodeWriter(quiet=True)
+    writer.setFilename('Main.vm')
+    with pytest.raises(Translator.SourceError):
+        Pipeline.writeCommands(writer, commands)
+
+def test_api_does_not_import_the_command_line():
+    import ast
+    import vmt
+    for module, other in ((Translator, 'vmt'), (vmt, 'Translator'), (Pipeline, 'vmt'), (Pipeline, 'Translator')):
+        with open(module.__file__) as f:
+            tree = ast.parse(f.read())
+        imported = {alias.name for node in ast.walk(tree) if isinstance(node, ast.Import) for alias in node.names}
+        assert other not in imported, module.__name__
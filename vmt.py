@@ -4,24 +4,43 @@
 
 import Parser
 import CodeWriter
+import Peephole
+import CallGraph
+import ConstantFolder
+import BranchFuser
+import Inliner
+import TailCaller
+import BuildCache
+import Profiler
+import Pipeline
+import Stats
 import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import json
 import os
 import sys
+import time
 
-def main() -> None:
+VERSION = '1.1'     # part of the build cache key, with a hash of the translator sources
+
+def main(argv: list = None, cache: BuildCache.BuildCache = None) -> None:
     """
     VM Translator by Jack Christensen Sep-2022.
     Project 08 from "The Elements of Computing Systems"
     by Nisan and Schocken, MIT Press. Also www.nand2tetris.org
+    argv and cache are given by the translation server (Server.py),
+    which keeps its cache in memory between builds.
     """
 
     # process command line arguments
-    argParser = argparse.ArgumentParser(
-        description='A VM Translator for the Hack computer.',
-        epilog='VM Translator by Jack Christensen. Project 08 from "The Elements of Computing Systems" by Nisan and Schocken, MIT Press. Also www.nand2tetris.org')
-    argParser.add_argument('source', help='Input file or directory')
-    args = argParser.parse_args()
+    argParser = makeArgParser()
+    args = argParser.parse_args(argv)
+    if args.hack and args.profile:
+        argParser.error('--profile needs the assembly code, it cannot be used with --hack')
 
+    outExt = '.hack' if args.hack else '.asm'
     fileList = []
     if os.path.isfile(args.source):
         # source is a file, process the input filename
@@ -39,7 +58,7 @@ def main() -> None:
             sys.exit(3)
         fileList.append(args.source)
         # output filename is same as input filename
-        outFilename = filename + '.asm'
+        outFilename = filename + outExt
         if inDir:
             outFilename = inDir + os.sep + outFilename
     elif os.path.isdir(args.source):
@@ -53,7 +72,7 @@ def main() -> None:
             if e.is_file() and e.name[-3:] == '.vm':
                 fileList.append(dirName + os.sep + e.name)
         # output filename is same as input directory name
-        outFilename = dirName + os.sep + os.path.basename(dirName) + '.asm'
+        outFilename = dirName + os.sep + os.path.basename(dirName) + outExt
     else:
         print(f'Source is invalid: {args.source}', file=sys.stderr)
         sys.exit(4)
@@ -63,47 +82,309 @@ def main() -> None:
         sys.exit(5)
 
     print(f'\n** VM TRANSLATOR starting for {args.source}', file=sys.stderr)
-    writer = CodeWriter.CodeWriter()
+    options = {'sharedCallReturn': args.shared_calls, 'sourceMap': args.profile, 'cacheTop': args.cache_top,
+               'directAddressing': args.direct_addressing, 'localInit': args.local_init,
+               'localInitBudget': args.local_init_budget}
+    peephole = Peephole.Peephole() if args.peephole else None
+    passOptions = {'fold': args.fold, 'fuse': args.fuse_branches, 'tail': args.tail_calls}
+    stats = None
+    if args.stats or args.stats_json or args.cprofile:
+        stats = Stats.Stats(profile=bool(args.cprofile))
+    phase = stats.phase if stats else lambda name: contextlib.nullcontext()
+    writer = CodeWriter.CodeWriter(peephole=peephole, hack=args.hack, **options)
+    writer.stats = stats
     for f in fileList:
         if os.path.basename(f) == 'Sys.vm':
-            writer.setFilename(f)
-            writer.writeBootstrap()
+            with phase('codegen'):
+                writer.setFilename(f)
+                writer.writeBootstrap()
             break
 
-    for file in fileList:
-        writer.setFilename(file)
-        parser = Parser.Parser(file)
-        while parser.hasMoreLines():
-            parser.advance()
-            #print(parser.commandType(), parser.currentCmd)
-            if parser.commandType() == 'C_ERROR':
-                print('Translation terminated.')
-                sys.exit(5)
-            elif parser.commandType() == 'C_COMMENT':
-                writer.writeComment(parser.currentCmd)
-            elif parser.commandType() == 'C_PUSH' or parser.commandType() == 'C_POP':
-                writer.writePushPop(parser.currentCmd, parser.arg0(), parser.arg1(), parser.arg2())
-            elif parser.commandType() == 'C_ARITHMETIC':
-                writer.writeArithmetic(parser.currentCmd, parser.arg0())
-            elif parser.commandType() == 'C_LABEL':
-                writer.writeLabel(parser.currentCmd, parser.arg1())
-            elif parser.commandType() == 'C_GOTO':
-                writer.writeGoto(parser.currentCmd, parser.arg1())
-            elif parser.commandType() == 'C_IF':
-                writer.writeIf(parser.currentCmd, parser.arg1())
-            elif parser.commandType() == 'C_FUNCTION':
-                writer.writeFunction(parser.currentCmd, parser.arg1(), int(parser.arg2()))
-            elif parser.commandType() == 'C_RETURN':
-                writer.writeReturn(parser.currentCmd)
-            elif parser.commandType() == 'C_CALL':
-                writer.writeCall(parser.currentCmd, parser.arg1(), parser.arg2())
+    commandLists = None
+    reachable = None
+    dropped = None
+    if cache is None and args.cache:
+        cache = BuildCache.BuildCache(args.cache, args.cache_size * 1024 * 1024, translatorVersion())
+    if (args.prune or args.inline) and not args.stream:
+        # whole-program modes look at all the files before translating, parse them once
+        # (when streaming, the files are read again rather than kept in memory)
+        commandLists = [cache.commands(file) if cache else parseFile(file, stats) for file in fileList]
+    wholeProgram = lambda: ((file, commandLists[i] if commandLists else Parser.Parser(file, stream=True).commands())
+                            for i, file in enumerate(fileList))
+    if args.inline:
+        # find the functions to inline, the pass in each worker gets them through passOptions
+        inliner = Inliner.Inliner(args.inline_size)
+        with phase('analyze'):
+            for file, commands in wholeProgram():
+                inliner.addFile(commands)
+        passOptions['inline'] = inliner.functions
+    passes = Pipeline.makePasses(passOptions)
+    if args.prune:
+        # build the call graph, then translate only the reachable functions
+        graph = CallGraph.CallGraph()
+        with phase('analyze'):
+            for file, commands in wholeProgram():
+                graph.addFile(progName(file), commands)
+        if 'Sys.init' in graph.files:
+            reachable = graph.reachable()
+            dropped = CodeWriter.CodeWriter(**options)    # code for unreachable functions goes here
+            if args.stream:
+                dropped.stream(os.devnull)
+        else:
+            print('Sys.init not found, no functions dropped', file=sys.stderr)
+
+    temp = None
+    try:
+        if args.stream:
+            # written under another name first, so a failed translation leaves no partial output
+            temp = outFilename + '.tmp'
+            writer.stream(temp)
+        if args.jobs == 1 and not cache and stats:
+            # each phase in turn for each file, to time them apart: the files are read whole
+            for i, file in enumerate(fileList):
+                commands = commandLists[i] if commandLists else parseFile(file, stats)
+                with stats.profiling():
+                    with phase('optimize'):
+                        for p in passes:
+                            commands = list(p.optimize(commands))
+                    with phase('codegen'):
+                        translateFile(writer, file, commands, reachable, dropped)
+        elif args.jobs == 1 and not cache:
+            for i, file in enumerate(fileList):
+                commands = commandLists[i] if commandLists else Parser.Parser(file, args.stream).commands()
+                translateFile(writer, file, commands, reachable, dropped, passes)
+        else:
+            # translate each file to a separate fragment, or take it from the cache, then link them in order
+            keys = [None] * len(fileList)
+            if cache:
+                for i, file in enumerate(fileList):
+                    extra = ''
+                    if reachable is not None:
+                        extra = ' '.join(sorted(name for name in reachable if graph.files.get(name) == progName(file)))
+                    keys[i] = cache.key(file, dict(options, **passOptions), extra)
+            missing = [i for i, key in enumerate(keys) if not (cache and cache.contains(key))]
+            work = ([fileList[i] for i in missing], [options] * len(missing), [reachable] * len(missing),
+                    [passOptions] * len(missing))
+            pool = None
+            if args.jobs != 1 and len(missing) > 1:
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None)
+                results = pool.map(translateFragment, *work)
             else:
-                print('Translation terminated.')
-                sys.exit(6)
+                results = map(translateFragment, *work)
+            try:
+                # fragments are loaded or translated as they are needed, so only a few are in memory at once
+                for i, file in enumerate(fileList):
+                    fragment = None
+                    if cache and i not in missing:
+                        with phase('cache'):
+                            fragment = cache.get(keys[i])
+                    if fragment is None:
+                        with stats.profiling() if stats else contextlib.nullcontext():
+                            fragment = next(results) if i in missing else translateFragment(file, options, reachable, passOptions)
+                        if stats:
+                            # the time in the process that translated it: reading, parsing and code generation
+                            stats.addTime('translate', fragment[2])
+                        if cache:
+                            with phase('cache'):
+                                cache.put(keys[i], fragment, fragment[2])
+                    with phase('link'):
+                        writer.link(fragment[0])
+                    if dropped:
+                        dropped.words += fragment[1]
+                    for p, used in zip(passes, fragment[3]):
+                        p.add(used)
+            finally:
+                if pool:
+                    pool.shutdown()
+            if cache:
+                cache.evict()
 
-    # all done
-    writer.close(outFilename)
+        # all done
+        # the peephole optimizer runs here unless streaming
+        with phase('peephole and write' if peephole and not args.stream else 'write'):
+            writer.close(outFilename)
+        if temp:
+            os.replace(temp, outFilename)
+            temp = None
+    except Pipeline.SourceError:
+        # the Parser has reported the error
+        print('Translation terminated.')
+        sys.exit(5)
+    except ValueError as e:
+        if not args.hack:
+            raise
+        # only the assembler raises this, e.g. when the program does not fit in ROM,
+        # and when streaming, it assembles the code as it is translated
+        print(f'Error: Cannot assemble the output: {str(e)}', file=sys.stderr)
+        sys.exit(6)
+    finally:
+        if temp:
+            if writer.output and not args.hack:
+                # the Assembler writes nothing until it is closed
+                writer.output.close()
+            if os.path.exists(temp):
+                os.remove(temp)
+    if args.shared_calls:
+        print(writer.sharedCallReport(), file=sys.stderr)
+    if args.inline:
+        print(writer.inlineReport(), file=sys.stderr)
+    if args.local_init != 'push':
+        print(writer.localInitReport(), file=sys.stderr)
+    if args.direct_addressing and not args.profile:
+        print(writer.addressingReport(), file=sys.stderr)
+    for p in passes:
+        print(p.report(), file=sys.stderr)
+    if peephole:
+        print(peephole.report(), file=sys.stderr)
+    if cache:
+        print(cache.report(), file=sys.stderr)
+    if reachable is not None:
+        unused = graph.unreachable()
+        for name in unused:
+            print(f'Dropped unreachable function {name} ({graph.files[name]}.vm)', file=sys.stderr)
+        print(f'Dropped {len(unused)} functions, {dropped.words} ROM words saved', file=sys.stderr)
+    if stats:
+        stats.finish(writer.words)
+        if args.stats:
+            print(stats.report(), file=sys.stderr)
+        if args.stats_json == '-':
+            print(json.dumps(stats.toDict(), indent=2))
+        elif args.stats_json:
+            with open(args.stats_json, 'w') as f:
+                json.dump(stats.toDict(), f, indent=2)
+        if args.cprofile:
+            stats.dumpProfile(args.cprofile)
     print(f'** VM TRANSLATOR COMPLETE, output to {outFilename}', file=sys.stderr)
+    if args.profile:
+        with open(outFilename) as f:
+            profiler = Profiler.Profiler(f.readlines(), writer.sourceMap, writer.commentLines)
+        profiler.run(args.cycles)
+        print(profiler.report(), file=sys.stderr)
+        if args.direct_addressing:
+            # the cycles saved, from the times each push and pop ran
+            executions = {}
+            for (progname, number, text, function), n in zip(profiler.commands, profiler.commandCounts()):
+                parts = text.split()
+                if len(parts) == 3 and parts[0] in ('push', 'pop') and parts[2].isdigit():
+                    key = (parts[0], parts[1], int(parts[2]))
+                    executions[key] = executions.get(key, 0) + n
+            print(writer.addressingReport(executions), file=sys.stderr)
+
+def makeArgParser() -> argparse.ArgumentParser:
+    """Returns the parser of vmt's command line, also used by Server.py to find the sources."""
+    argParser = argparse.ArgumentParser(
+        description='A VM Translator for the Hack computer.',
+        epilog='VM Translator by Jack Christensen. Project 08 from "The Elements of Computing Systems" by Nisan and Schocken, MIT Press. Also www.nand2tetris.org')
+    argParser.add_argument('source', help='Input file or directory')
+    addCodeOptions(argParser)
+    argParser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Translate files in parallel using this many processes (0 = one per CPU)')
+    argParser.add_argument('--cache', metavar='DIR',
+        help='Keep translated files in this directory and only retranslate files that changed')
+    argParser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+        help='Maximum size of the build cache (default 256MB)')
+    argParser.add_argument('--stream', action='store_true',
+        help='Read input and write output a piece at a time, so memory use does not grow with program size')
+    argParser.add_argument('--profile', action='store_true',
+        help='Run the translated program in the emulator and report the cycles spent per function and VM line')
+    argParser.add_argument('--cycles', type=int, default=10_000_000,
+        help='Cycle limit when running the program (default 10000000)')
+    argParser.add_argument('--stats', action='store_true',
+        help='Report the time spent in each phase and the ROM words per VM command and per function')
+    argParser.add_argument('--stats-json', metavar='FILE',
+        help='Write the statistics to this file as JSON (- for standard output)')
+    argParser.add_argument('--cprofile', metavar='FILE',
+        help='Profile the translation with cProfile, not including worker processes, '
+             'and write the profile to this file for pstats')
+    return argParser
+
+def addCodeOptions(argParser: argparse.ArgumentParser) -> None:
+    """Adds the options that change the code generated, shared with Batch.py."""
+    argParser.add_argument('--shared-calls', action='store_true',
+        help='Use shared __CALL/__RETURN routines instead of inline call and return code')
+    argParser.add_argument('--peephole', action='store_true',
+        help='Run the peephole optimizer over the generated code')
+    argParser.add_argument('--prune', action='store_true',
+        help='Translate only the functions reachable from Sys.init')
+    argParser.add_argument('--cache-top', action='store_true',
+        help='Keep the top of the stack in the D register between VM commands where possible')
+    argParser.add_argument('--direct-addressing', action='store_true',
+        help='Use addresses known at translation time for push and pop instead of computing them')
+    argParser.add_argument('--local-init', choices=CodeWriter.LOCAL_INIT, default='push',
+        help='How functions set their local variables to 0: push each (default), unroll, '
+             'loop, or auto to choose by size and speed')
+    argParser.add_argument('--local-init-budget', type=int, default=8, metavar='WORDS',
+        help='With --local-init auto, the extra ROM words per function allowed for faster code (default 8)')
+    argParser.add_argument('--inline', action='store_true',
+        help='Replace calls to small leaf functions with the function body')
+    argParser.add_argument('--inline-size', type=int, default=12, metavar='N',
+        help='Largest function to inline, in VM commands (default 12)')
+    argParser.add_argument('--fold', action='store_true',
+        help='Fold constant expressions and simplify arithmetic on constants before translating')
+    argParser.add_argument('--fuse-branches', action='store_true',
+        help='Translate a comparison followed by if-goto as a single conditional jump')
+    argParser.add_argument('--tail-calls', action='store_true',
+        help='Translate a call followed by return as a jump that reuses the current frame')
+    argParser.add_argument('--hack', action='store_true',
+        help='Assemble the output and write Hack machine code (.hack) instead of assembly code (.asm)')
+
+def parseFile(file: str, stats: Stats.Stats = None) -> list:
+    """Returns the parsed Commands of a .vm file, timing reading and parsing if stats are kept."""
+    if not stats:
+        return list(Parser.Parser(file).commands())
+    with stats.phase('read'):
+        parser = Parser.Parser(file)
+    with stats.phase('parse'):
+        return list(parser.commands())
+
+def translateFile(writer: CodeWriter.CodeWriter, file: str, commands, reachable: set = None,
+                  dropped: CodeWriter.CodeWriter = None,
+                  passes: list = ()) -> None:
+    """
+    Translates the parsed Commands of one .vm file. If reachable is given,
+    functions not in it are translated to the dropped writer instead.
+    The Commands go through the optimization passes first, in order.
+    """
+    for p in passes:
+        commands = p.optimize(commands)
+    writer.setFilename(file)
+    if dropped:
+        dropped.progname = writer.progname
+    Pipeline.writeCommands(writer, commands, reachable, dropped)
+    # the next file's code must find the whole stack in RAM
+    writer.spillTop()
+    if dropped:
+        dropped.spillTop()
+
+def translateFragment(file: str, options: dict, reachable: set = None, passOptions: dict = None) -> tuple:
+    """
+    Translates one .vm file on its own, starting at address 0, for
+    linking with CodeWriter.link(). Runs in a worker process.
+    Returns the CodeWriter, the number of words dropped, the time taken
+    and the optimization passes used, for their counts.
+    """
+    start = time.perf_counter()
+    writer = CodeWriter.CodeWriter(**options)
+    dropped = CodeWriter.CodeWriter(**options) if reachable is not None else None
+    passes = Pipeline.makePasses(passOptions or {})
+    translateFile(writer, file, Parser.Parser(file).commands(), reachable, dropped, passes)
+    return writer, dropped.words if dropped else 0, time.perf_counter() - start, passes
+
+def progName(file: str) -> str:
+    """Returns the file name without directory or extension."""
+    return os.path.basename(file).rsplit(sep='.', maxsplit=1)[0]
+
+def translatorVersion() -> str:
+    """
+    Returns VERSION plus a hash of the translator's source files, so
+    cached translations are not reused after the translator changes.
+    """
+    h = hashlib.sha256()
+    for module in (Parser, CodeWriter, Peephole, CallGraph, ConstantFolder, BranchFuser, Inliner,
+                   TailCaller, Pipeline, sys.modules[__name__]):
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    return VERSION + '-' + h.hexdigest()[:16]
 
 if __name__ == '__main__':
     main()